@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+"""
+Finds near-duplicate books and chapters in text files written by "extract_epub_chapters.py" or "extract_html_chapters.py", e.g. the same book in different formats or individual books also contained in an omnibus volume.
+
+The duplicates found are written to standard output; Optionally, a copy of the books without any redundant chapters is also written.
+"""
+
+__author__ = "Todd Shore <errantlinguist+github@gmail.com>"
+__copyright__ = "Copyright (C) 2018 Todd Shore"
+__license__ = "Apache License, Version 2.0"
+
+import argparse
+import csv
+import logging
+import os
+import sys
+from typing import Dict, List
+
+from storygenerator_preprocessing import Chapter, natural_keys
+from storygenerator_preprocessing.dedup import NEAR_DUPLICATE_RELATION, ChapterKey, MinHasher, find_duplicates
+from storygenerator_preprocessing.io import read_chapters, write_chapters
+
+
+def __create_argparser() -> argparse.ArgumentParser:
+	result = argparse.ArgumentParser(
+		description="Finds near-duplicate books and chapters in text files written by \"extract_epub_chapters.py\" or \"extract_html_chapters.py\".")
+	result.add_argument("infiles", metavar="PATH", nargs="+",
+						help="The book files to read; If a book is duplicated, the file sorted first is kept.")
+	result.add_argument("-o", "--outdir", metavar="PATH",
+						help="The directory to write the books to without any redundant chapters.")
+	result.add_argument("-t", "--threshold", metavar="SIMILARITY", type=float, default=0.8,
+						help="The minimum estimated Jaccard similarity for two chapters or books to be considered duplicates.")
+	result.add_argument("-n", "--num-perm", metavar="COUNT", type=int, default=128,
+						help="The number of hash permutations used for each MinHash signature.")
+	result.add_argument("-k", "--shingle-size", metavar="COUNT", type=int, default=5,
+						help="The number of consecutive words in each shingle.")
+	log_args = result.add_mutually_exclusive_group()
+	log_args.add_argument("-i", "--info", help="increase output verbosity to INFO.",
+						  action="store_true")
+	log_args.add_argument("-d", "--debug", help="increase output verbosity to DEBUG.",
+						  action="store_true")
+	return result
+
+
+def __create_chapter_desc(key: ChapterKey, book_chapters: Dict[str, List[Chapter]]) -> str:
+	chapter = book_chapters[key.book][key.idx]
+	return "{} ({}: {})".format(key.book, chapter.seq, chapter.title)
+
+
+def __main(args):
+	if args.debug:
+		logging.basicConfig(level=logging.DEBUG)
+	elif args.info:
+		logging.basicConfig(level=logging.INFO)
+
+	infiles = tuple(sorted(frozenset(args.infiles), key=natural_keys))
+	logging.info("Will read %d file(s).", len(infiles))
+	book_chapters = {}
+	book_infiles = {}
+	for infile in infiles:
+		logging.info("Reading \"%s\".", infile)
+		book_title = os.path.splitext(os.path.basename(infile))[0]
+		if book_title in book_infiles:
+			raise ValueError("Book titled \"{}\" found in both \"{}\" and \"{}\".".format(book_title,
+																							  book_infiles[book_title],
+																							  infile))
+		with open(infile, 'r') as inf:
+			book_chapters[book_title] = list(read_chapters(inf))
+		book_infiles[book_title] = infile
+
+	hasher = MinHasher(args.num_perm, args.shingle_size)
+	report = find_duplicates(book_chapters.items(), hasher, args.threshold)
+	print("Found {} duplicate chapter pair(s) and {} related book pair(s).".format(len(report.chapter_pairs),
+																				  len(report.book_pairs)),
+		  file=sys.stderr)
+
+	writer = csv.writer(sys.stdout, dialect=csv.excel_tab)
+	writer.writerow(("LEVEL", "FIRST", "SECOND", "RELATION", "SIMILARITY"))
+	for first, second, relation, similarity in report.book_pairs:
+		writer.writerow(("book", first, second, relation, similarity))
+	for first, second, similarity in report.chapter_pairs:
+		writer.writerow(("chapter", __create_chapter_desc(first, book_chapters),
+						 __create_chapter_desc(second, book_chapters), NEAR_DUPLICATE_RELATION, similarity))
+
+	outdir = args.outdir
+	if outdir:
+		os.makedirs(outdir, exist_ok=True)
+		redundant_chapters = report.redundant_chapters
+		written_book_count = 0
+		for book_title, chapters in book_chapters.items():
+			kept_chapters = [chapter for idx, chapter in enumerate(chapters) if
+							 ChapterKey(book_title, idx) not in redundant_chapters]
+			if kept_chapters:
+				outfile_path = os.path.join(outdir, os.path.basename(book_infiles[book_title]))
+				logging.info("Writing %d of %d chapter(s) of book titled \"%s\" to \"%s\".", len(kept_chapters),
+							 len(chapters), book_title, outfile_path)
+				with open(outfile_path, 'w') as outf:
+					write_chapters(kept_chapters, outf)
+				written_book_count += 1
+			else:
+				logging.info("Skipping book titled \"%s\" because all its chapters are redundant.", book_title)
+		print("Finished writing {} of {} book(s).".format(written_book_count, len(book_chapters)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+	__main(__create_argparser().parse_args())
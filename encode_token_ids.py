@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+"""
+Encodes normalized book chapters as NumPy arrays of token IDs using a lexicon written by "write_token_counts.py".
+
+Each shard is written as a set of ".npy" files which can be memory-mapped, e.g. using
+"storygenerator_preprocessing.encoding.load_shard".
+"""
+
+__author__ = "Todd Shore <errantlinguist+github@gmail.com>"
+__copyright__ = "Copyright (C) 2018 Todd Shore"
+__license__ = "Apache License, Version 2.0"
+
+import argparse
+import os
+import sys
+from typing import Iterator, List, Sequence
+
+import nltk
+
+from storygenerator_preprocessing import Chapter, natural_keys
+from storygenerator_preprocessing.encoding import OOV_ID, ShardEncoder, read_lexicon, save_shard
+from storygenerator_preprocessing.io import read_chapters
+
+
+def __create_argparser() -> argparse.ArgumentParser:
+	result = argparse.ArgumentParser(
+		description="Encodes normalized book chapters as NumPy arrays of token IDs using a lexicon written by \"write_token_counts.py\".")
+	result.add_argument("infiles", metavar="PATH", nargs="+",
+						help="The book files to read.")
+	result.add_argument("-l", "--lexicon", metavar="PATH", required=True,
+						help="The lexicon file to read the vocabulary from.")
+	result.add_argument("-o", "--outdir", metavar="PATH", required=True,
+						help="The directory to write the encoded shards to.")
+	result.add_argument("-s", "--shard-size", metavar="COUNT", type=int, default=100,
+						help="The number of books to write to each shard.")
+	result.add_argument("-b", "--batch-size", metavar="COUNT", type=int, default=65536,
+						help="The number of tokens to encode at once.")
+	return result
+
+
+def __read_books(infiles: Sequence[str]) -> Iterator[List[Chapter]]:
+	for infile in infiles:
+		print("Reading \"{}\".".format(infile), file=sys.stderr)
+		with open(infile, 'r') as inf:
+			yield list(read_chapters(inf))
+
+
+def __main(args):
+	lexicon_path = args.lexicon
+	print("Reading lexicon from \"{}\".".format(lexicon_path), file=sys.stderr)
+	with open(lexicon_path, 'r', newline='') as inf:
+		vocab = read_lexicon(inf)
+	print("Read vocabulary of {} token type(s).".format(len(vocab)), file=sys.stderr)
+	encoder = ShardEncoder(vocab, nltk.tokenize.word_tokenize, args.batch_size)
+
+	infiles = tuple(sorted(frozenset(args.infiles), key=natural_keys))
+	shard_size = args.shard_size
+	outdir = args.outdir
+	os.makedirs(outdir, exist_ok=True)
+	for shard_idx, start in enumerate(range(0, len(infiles), shard_size)):
+		shard = encoder(__read_books(infiles[start:start + shard_size]))
+		oov_count = int((shard.token_ids == OOV_ID).sum())
+		path_prefix = os.path.join(outdir, "shard-{:05d}".format(shard_idx))
+		print("Writing shard of {} token(s) ({} OOV) to \"{}\".".format(len(shard.token_ids), oov_count, path_prefix),
+			  file=sys.stderr)
+		save_shard(shard, path_prefix)
+
+
+if __name__ == "__main__":
+	__main(__create_argparser().parse_args())
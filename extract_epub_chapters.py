@@ -9,14 +9,19 @@ __copyright__ = "Copyright (C) 2018 Todd Shore"
 __license__ = "Apache License, Version 2.0"
 
 import argparse
+import functools
 import logging
 import os
-from typing import Callable, Iterable, Iterator
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
 
 import magic
 
-from storygenerator_preprocessing import natural_keys
-from storygenerator_preprocessing.io import EPUBChapterReader, write_chapters
+from storygenerator_preprocessing import Chapter, natural_keys
+from storygenerator_preprocessing.io import DEFAULT_HTML_FEATURES, EPUBChapterReader, write_chapters
+from storygenerator_preprocessing.pipeline import BackgroundWriter, Prefetcher
+from storygenerator_preprocessing.sharding import parse_shard_spec, select_shard, write_manifest
+from storygenerator_preprocessing.structure import ChapterStructureCache, merge_worker_caches
+from storygenerator_preprocessing.supervision import SupervisedExecutor, write_failures
 
 EPUB_MIMETYPE = "application/epub+zip"
 
@@ -49,6 +54,27 @@ def __create_argparser() -> argparse.ArgumentParser:
 						help="The paths to search for files to read.")
 	result.add_argument("-o", "--outdir", metavar="PATH",
 						help="The directory to write the extracted book data to.", required=True)
+	result.add_argument("-p", "--prefetch", metavar="COUNT", type=int, default=2,
+						help="The maximum number of input files to read ahead of the one being parsed.")
+	result.add_argument("--prefetch-mb", metavar="MB", type=float, default=64,
+						help="The maximum number of megabytes of input files to read ahead of the one being parsed; Larger files are not read ahead but only the parts of them which are needed are read while parsing.")
+	result.add_argument("-w", "--write-queue", metavar="COUNT", type=int, default=2,
+						help="The maximum number of books waiting to be written before parsing blocks.")
+	result.add_argument("-s", "--shard", metavar="i/N", type=parse_shard_spec,
+						help="Only process the i-th of N shards of the input (counting from zero) and write a shard manifest to the output directory; Use \"merge_shards.py\" to combine the output of all shards.")
+	result.add_argument("-c", "--structure-cache", metavar="PATH",
+						help="A file to remember which chapter-parsing strategy works for each document structure in, so that strategies which cannot succeed can be skipped for further documents with the same structure, e.g. from the same publisher; The cache never changes which chapters are parsed.")
+	supervision_args = result.add_argument_group("supervision", "Parse each book in a separate worker process, quarantining any which cannot be parsed.")
+	supervision_args.add_argument("-j", "--jobs", metavar="COUNT", type=int, default=1,
+								  help="The number of worker processes to parse books with; If greater than one, books are parsed in supervised worker processes.")
+	supervision_args.add_argument("-t", "--timeout", metavar="SECS", type=float,
+								  help="The maximum number of seconds a worker may spend parsing a book; Implies supervised parsing.")
+	supervision_args.add_argument("-m", "--max-rss", metavar="MB", type=float,
+								  help="The maximum resident memory in megabytes used only by a worker, i.e. not shared with other processes, while parsing a book; Implies supervised parsing.")
+	supervision_args.add_argument("--fallback-features", metavar="FEATURES", default="lxml",
+								  help="The BeautifulSoup tree builder to retry parsing a book with if it failed the first time.")
+	supervision_args.add_argument("--failures", metavar="PATH",
+								  help="The file to write the report of the books which could not be parsed to; Default is \"failures.tsv\" in the output directory.")
 	log_args = result.add_mutually_exclusive_group()
 	log_args.add_argument("-i", "--info", help="increase output verbosity to INFO.",
 						  action="store_true")
@@ -57,6 +83,49 @@ def __create_argparser() -> argparse.ArgumentParser:
 	return result
 
 
+def __read_book(features: str, infile_path: str, strategy_cache: Optional[ChapterStructureCache]) -> Tuple[
+	Tuple[str, List[Chapter]], Optional[ChapterStructureCache]]:
+	if strategy_cache is not None:
+		# Only send back what was learned while reading this book for merging into the supervisor's cache
+		strategy_cache = strategy_cache.copy()
+	return EPUBChapterReader(features, strategy_cache)(infile_path), strategy_cache
+
+
+def __prefetched_size(max_bytes: int, infile_path: str) -> int:
+	size = os.path.getsize(infile_path)
+	return size if size <= max_bytes else 0
+
+
+def __read_books_prefetched(infiles: Sequence[str], prefetch: int, prefetch_bytes: int,
+							strategy_cache: Optional[ChapterStructureCache]) -> Iterator[
+	Tuple[str, Tuple[str, List[Chapter]]]]:
+	reader = EPUBChapterReader(strategy_cache=strategy_cache)
+	with Prefetcher(infiles, functools.partial(__read_prefetchable_bytes, prefetch_bytes), prefetch, prefetch_bytes,
+					functools.partial(__prefetched_size, prefetch_bytes)) as prefetcher:
+		for infile, content in prefetcher:
+			# Archives too large to prefetch are read lazily, decompressing only the documents which are used
+			yield infile, reader(infile, content)
+	logging.info("Read queue: %s", prefetcher.metrics)
+
+
+def __read_prefetchable_bytes(max_bytes: int, infile_path: str) -> Optional[bytes]:
+	if __prefetched_size(max_bytes, infile_path) > 0:
+		with open(infile_path, 'rb') as inf:
+			result = inf.read()
+	else:
+		result = None
+	return result
+
+
+def __is_supervised(args) -> bool:
+	return args.jobs > 1 or args.timeout is not None or args.max_rss is not None
+
+
+def __write_book(outfile_path: str, chapters: List[Chapter]):
+	with open(outfile_path, 'w') as outf:
+		write_chapters(chapters, outf)
+
+
 def __main(args):
 	if args.debug:
 		logging.basicConfig(level=logging.DEBUG)
@@ -67,17 +136,56 @@ def __main(args):
 	print("Will look for data under {}.".format(inpaths))
 	file_walker = MimetypeFileWalker(lambda mimetype: mimetype == EPUB_MIMETYPE)
 	infiles = tuple(sorted(frozenset(file_walker(inpaths)), key=natural_keys))
-	reader = EPUBChapterReader()
+	shard = args.shard
+	if shard:
+		infiles = tuple(select_shard(infiles, shard))
+		print("Processing shard {} of {}.".format(shard.index, shard.count))
 	logging.info("Will read %d file(s).", len(infiles))
 	outdir = args.outdir
 	os.makedirs(outdir, exist_ok=True)
-	for infile in infiles:
-		book_title, chapters = reader(infile)
-		outfile_path = os.path.join(outdir, book_title + ".txt")
-		print("Writing book titled \"{}\" to \"{}\".".format(book_title, outfile_path))
-		with open(outfile_path, 'w') as outf:
-			write_chapters(chapters, outf)
-	print("Finished writing {} file(s).".format(len(infiles)))
+	strategy_cache = ChapterStructureCache.load_or_create(args.structure_cache) if args.structure_cache else None
+	if __is_supervised(args):
+		executor = SupervisedExecutor(args.jobs, args.timeout, None if args.max_rss is None else int(args.max_rss * 1e6))
+		tasks = ((infile, ((__read_book, (DEFAULT_HTML_FEATURES, infile, strategy_cache)),
+						   (__read_book, (args.fallback_features, infile, strategy_cache)))) for infile in infiles)
+		books = merge_worker_caches((((infile, book), worker_strategy_cache) for infile, (book, worker_strategy_cache) in
+									 executor(tasks)), strategy_cache)
+	else:
+		executor = None
+		failures_path = None
+		# Read the next file(s) while parsing the current one
+		books = __read_books_prefetched(infiles, args.prefetch, int(args.prefetch_mb * 1e6), strategy_cache)
+
+	outfile_inputs = {}
+	# Write the previous book(s) while parsing the current one
+	with BackgroundWriter(__write_book, args.write_queue) as writer:
+		for infile, (book_title, chapters) in books:
+			outfile_path = os.path.join(outdir, book_title + ".txt")
+			previous_inputs = outfile_inputs.get(outfile_path)
+			# Keep the book read from the input which sorts first, as "merge_shards.py" does, regardless of the order books are parsed in
+			if previous_inputs and natural_keys(previous_inputs[0]) <= natural_keys(infile):
+				logging.warning("Book titled \"%s\" in \"%s\" was already read from \"%s\"; Not writing it.", book_title,
+								infile, previous_inputs[0])
+			else:
+				if previous_inputs:
+					logging.warning("Replacing book titled \"%s\" read from \"%s\" with the one in \"%s\".", book_title,
+									previous_inputs[0], infile)
+				print("Writing book titled \"{}\" to \"{}\".".format(book_title, outfile_path))
+				writer.submit(outfile_path, chapters)
+				outfile_inputs[outfile_path] = (infile,)
+	logging.info("Write queue: %s", writer.metrics)
+	if executor is not None:
+		failures_path = args.failures or os.path.join(outdir, "failures.tsv")
+		print("Writing report of {} failed file(s) to \"{}\".".format(len(executor.failures), failures_path))
+		with open(failures_path, 'w', newline='') as outf:
+			write_failures(executor.failures, outf)
+	if strategy_cache is not None:
+		strategy_cache.log_stats()
+		strategy_cache.save(args.structure_cache)
+	if shard:
+		manifest_path = write_manifest(outdir, shard, infiles, outfile_inputs, failures_path)
+		print("Wrote shard manifest to \"{}\".".format(manifest_path))
+	print("Finished writing {} file(s).".format(len(outfile_inputs)))
 
 
 if __name__ == "__main__":
@@ -12,10 +12,15 @@ import argparse
 import logging
 import os
 import re
-from typing import Iterable, Iterator
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple
 
-from storygenerator_preprocessing import natural_keys
-from storygenerator_preprocessing.io import HTMLChapterReader, write_chapters
+from storygenerator_preprocessing import Chapter, natural_keys
+from storygenerator_preprocessing.io import DEFAULT_HTML_FEATURES, HTMLChapterReader, write_chapters
+from storygenerator_preprocessing.pipeline import Prefetcher
+from storygenerator_preprocessing.sharding import parse_shard_spec, select_shard_by_key, write_manifest
+from storygenerator_preprocessing.structure import ChapterStructureCache, merge_worker_caches
+from storygenerator_preprocessing.supervision import SupervisedExecutor, TaskFailure, write_failures
 
 
 class HTMLFileWalker(object):
@@ -46,6 +51,23 @@ def __create_argparser() -> argparse.ArgumentParser:
 						help="The paths to search for files to read.")
 	result.add_argument("-o", "--outdir", metavar="PATH",
 						help="The directory to write the extracted book data to.", required=True)
+	result.add_argument("-p", "--prefetch", metavar="COUNT", type=int, default=2,
+						help="The maximum number of input files to read ahead of the one being parsed.")
+	result.add_argument("-s", "--shard", metavar="i/N", type=parse_shard_spec,
+						help="Only process the i-th of N shards of the input (counting from zero) and write a shard manifest to the output directory; Use \"merge_shards.py\" to combine the output of all shards.")
+	result.add_argument("-c", "--structure-cache", metavar="PATH",
+						help="A file to remember which chapter-parsing strategy works for each document structure in, so that strategies which cannot succeed can be skipped for further documents with the same structure, e.g. from the same publisher; The cache never changes which chapters are parsed.")
+	supervision_args = result.add_argument_group("supervision", "Parse each book in a separate worker process, quarantining any which cannot be parsed.")
+	supervision_args.add_argument("-j", "--jobs", metavar="COUNT", type=int, default=1,
+								  help="The number of worker processes to parse books with; If greater than one, books are parsed in supervised worker processes.")
+	supervision_args.add_argument("-t", "--timeout", metavar="SECS", type=float,
+								  help="The maximum number of seconds a worker may spend parsing a book; Implies supervised parsing.")
+	supervision_args.add_argument("-m", "--max-rss", metavar="MB", type=float,
+								  help="The maximum resident memory in megabytes used only by a worker, i.e. not shared with other processes, while parsing a book; Implies supervised parsing.")
+	supervision_args.add_argument("--fallback-features", metavar="FEATURES", default="lxml",
+								  help="The BeautifulSoup tree builder to retry parsing a book with if it failed the first time.")
+	supervision_args.add_argument("--failures", metavar="PATH",
+								  help="The file to write the report of the books which could not be parsed to; Default is \"failures.tsv\" in the output directory.")
 	log_args = result.add_mutually_exclusive_group()
 	log_args.add_argument("-i", "--info", help="increase output verbosity to INFO.",
 						  action="store_true")
@@ -54,6 +76,50 @@ def __create_argparser() -> argparse.ArgumentParser:
 	return result
 
 
+def __group_book_files(infiles: Iterable[str], book_titles: Mapping[str, str]) -> Dict[str, List[str]]:
+	result = defaultdict(list)
+	for infile in infiles:
+		book_title = book_titles.get(infile)
+		if book_title is not None:
+			result[book_title].append(infile)
+	return result
+
+
+def __read_book_titles(infiles: Iterable[str], failures: Optional[List[TaskFailure]]) -> Dict[str, str]:
+	"""
+	:param infiles: The HTML files to read the book titles from.
+	:param failures: If not None, a list to add a failure for each file whose title could not be read to instead of raising an exception.
+	:return: The title of each file whose title could be read.
+	"""
+	result = {}
+	for infile in infiles:
+		try:
+			result[infile] = HTMLChapterReader.read_book_title(infile)
+		except Exception as e:
+			if failures is None:
+				raise
+			logging.error("Could not read book title from \"%s\" (%s); Quarantining it.", infile, e)
+			failures.append(TaskFailure(infile, ("Could not read book title: {}: {}".format(type(e).__name__, e),)))
+	return result
+
+
+def __read_book(features: str, infile_paths: Sequence[str], strategy_cache: Optional[ChapterStructureCache]) -> Tuple[
+	List[Tuple[str, List[Chapter]]], Optional[ChapterStructureCache]]:
+	if strategy_cache is not None:
+		# Only send back what was learned while reading this book for merging into the supervisor's cache
+		strategy_cache = strategy_cache.copy()
+	return list(HTMLChapterReader(features, strategy_cache)(infile_paths)), strategy_cache
+
+
+def __read_text(infile_path: str) -> str:
+	with open(infile_path) as inf:
+		return inf.read()
+
+
+def __is_supervised(args) -> bool:
+	return args.jobs > 1 or args.timeout is not None or args.max_rss is not None
+
+
 def __main(args):
 	if args.debug:
 		logging.basicConfig(level=logging.DEBUG)
@@ -64,18 +130,64 @@ def __main(args):
 	print("Will look for data under {}.".format(inpaths))
 	file_walker = HTMLFileWalker()
 	infiles = tuple(sorted(frozenset(file_walker(inpaths)), key=natural_keys))
+	strategy_cache = ChapterStructureCache.load_or_create(args.structure_cache) if args.structure_cache else None
+	reader = HTMLChapterReader(strategy_cache=strategy_cache)
+	shard = args.shard
+	supervised = __is_supervised(args)
+	failures = []  # type: List[TaskFailure]
+	if shard or supervised:
+		# Read the title of each file only once, both for sharding and for grouping the files of each book
+		book_titles = __read_book_titles(infiles, failures if supervised else None)
+	else:
+		book_titles = {}
+	if shard:
+		# Partition by book rather than by file because the files for each book are merged
+		infiles = tuple(select_shard_by_key(book_titles.keys(), book_titles.__getitem__, shard))
+		# Report each file whose title could not be read for only one shard
+		shard_failed_infiles = frozenset(select_shard_by_key((failure.key for failure in failures), str, shard))
+		failures = [failure for failure in failures if failure.key in shard_failed_infiles]
+		print("Processing shard {} of {}.".format(shard.index, shard.count))
 	logging.info("Will read %d file(s).", len(infiles))
-	reader = HTMLChapterReader()
-	book_chapters = dict(reader(infiles))
+	# Empty unless titles were read up front, i.e. when sharding or supervising parsing
+	book_files = __group_book_files(infiles, book_titles)
+	if supervised:
+		executor = SupervisedExecutor(args.jobs, args.timeout, None if args.max_rss is None else int(args.max_rss * 1e6))
+		tasks = ((book_title, ((__read_book, (DEFAULT_HTML_FEATURES, files, strategy_cache)),
+							   (__read_book, (args.fallback_features, files, strategy_cache)))) for book_title, files in
+				 book_files.items())
+		book_chapters = dict(
+			book for books in merge_worker_caches((result for _, result in executor(tasks)), strategy_cache) for
+			book in books)
+		failures.extend(executor.failures)
+		failures_path = args.failures or os.path.join(args.outdir, "failures.tsv")
+		print("Writing report of {} failed book(s) to \"{}\".".format(len(failures), failures_path))
+		os.makedirs(args.outdir, exist_ok=True)
+		with open(failures_path, 'w', newline='') as outf:
+			write_failures(failures, outf,
+						   lambda key: "{}: {}".format(key, ", ".join(book_files[key])) if key in book_files else key)
+	else:
+		failures_path = None
+		with Prefetcher(infiles, __read_text, args.prefetch) as prefetcher:
+			book_chapters = dict(reader.read_contents(prefetcher))
+		logging.info("Read queue: %s", prefetcher.metrics)
+	if strategy_cache is not None:
+		strategy_cache.log_stats()
+		strategy_cache.save(args.structure_cache)
 	print("Read data for {} book(s): {}".format(len(book_chapters), sorted(book_chapters.keys())))
 
 	outdir = args.outdir
 	os.makedirs(outdir, exist_ok=True)
+	outfile_inputs = {}
+	# All books have already been parsed because the files for each book have to be merged, so there's nothing to overlap writing with
 	for book_title, chapters in book_chapters.items():
 		outfile_path = os.path.join(outdir, book_title + ".txt")
 		print("Writing book titled \"{}\" to \"{}\".".format(book_title, outfile_path))
 		with open(outfile_path, 'w') as outf:
 			write_chapters(chapters, outf)
+		outfile_inputs[outfile_path] = book_files.get(book_title, ())
+	if shard:
+		manifest_path = write_manifest(outdir, shard, infiles, outfile_inputs, failures_path)
+		print("Wrote shard manifest to \"{}\".".format(manifest_path))
 
 
 if __name__ == "__main__":
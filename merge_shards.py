@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+"""
+Merges the output of a sharded run of "extract_epub_chapters.py" or "extract_html_chapters.py", verifying that every shard has finished and that its output is intact.
+"""
+
+__author__ = "Todd Shore <errantlinguist+github@gmail.com>"
+__copyright__ = "Copyright (C) 2018 Todd Shore"
+__license__ = "Apache License, Version 2.0"
+
+import argparse
+import csv
+import logging
+import os
+import shutil
+from collections import defaultdict, namedtuple
+from typing import Any, DefaultDict, Dict, IO, Iterable, Iterator, List, Tuple, Union
+
+from storygenerator_preprocessing import atomic_write, natural_keys
+from storygenerator_preprocessing.sharding import MANIFEST_FILENAME_PATTERN, ShardSpec, file_matches, read_manifest, \
+	write_manifest
+
+# The inputs read by all shards; The output to keep for each output filename; The failure reports of all shards; And a description of each output which was discarded because another shard created a different file with the same name
+MergePlan = namedtuple("MergePlan", "inputs outputs failure_reports conflicts")
+# An output file of a shard together with the inputs it was created from
+ShardOutput = namedtuple("ShardOutput", "path sha256 inputs shard_idx")
+
+
+def __create_argparser() -> argparse.ArgumentParser:
+	result = argparse.ArgumentParser(
+		description="Merges the output of a sharded run of \"extract_epub_chapters.py\" or \"extract_html_chapters.py\".")
+	result.add_argument("shard_dirs", metavar="PATH", nargs='+',
+						help="The output directories of the shards to merge.")
+	result.add_argument("-o", "--outdir", metavar="PATH",
+						help="The directory to write the merged output to.", required=True)
+	log_args = result.add_mutually_exclusive_group()
+	log_args.add_argument("-i", "--info", help="increase output verbosity to INFO.",
+						  action="store_true")
+	log_args.add_argument("-d", "--debug", help="increase output verbosity to DEBUG.",
+						  action="store_true")
+	return result
+
+
+def find_manifests(shard_dirs: Iterable[str]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+	for shard_dir in shard_dirs:
+		for filename in sorted(os.listdir(shard_dir)):
+			if MANIFEST_FILENAME_PATTERN.fullmatch(filename):
+				manifest_path = os.path.join(shard_dir, filename)
+				logging.info("Reading shard manifest \"%s\".", manifest_path)
+				yield shard_dir, read_manifest(manifest_path)
+
+
+def merge_failure_reports(paths: Iterable[str], out: IO[str]):
+	"""
+	:param paths: The failure reports to merge, each starting with the same header row.
+	:param out: The stream to write the merged tab-separated report to.
+	"""
+	writer = csv.writer(out, dialect=csv.excel_tab)
+	is_header_written = False
+	for path in paths:
+		with open(path, 'r', newline='') as inf:
+			reader = csv.reader(inf, dialect=csv.excel_tab)
+			header = next(reader, None)
+			if header is not None and not is_header_written:
+				writer.writerow(header)
+				is_header_written = True
+			writer.writerows(reader)
+
+
+def verify_manifests(manifests: Iterable[Tuple[str, Dict[str, Any]]]) -> MergePlan:
+	"""
+	:param manifests: Pairs of each shard output directory and the manifest therein.
+	:return: The plan for merging the shards.
+	:raises ValueError: If any shard is missing or any output is inconsistent with its manifest.
+	"""
+	problems = []
+	shard_counts = set()
+	shard_dirs_by_index = {}
+	input_shards = {}
+	output_candidates = defaultdict(list)  # type: DefaultDict[str, List[ShardOutput]]
+	failure_reports = []  # type: List[Tuple[int, str]]
+	for shard_dir, manifest in manifests:
+		shard_idx = manifest["index"]
+		shard_counts.add(manifest["count"])
+		if shard_idx in shard_dirs_by_index:
+			problems.append("Shard {} found in both \"{}\" and \"{}\".".format(shard_idx, shard_dirs_by_index[shard_idx],
+																			 shard_dir))
+		shard_dirs_by_index[shard_idx] = shard_dir
+
+		for infile in manifest["inputs"]:
+			if infile in input_shards:
+				problems.append(
+					"Input \"{}\" was read by both shard {} and shard {}.".format(infile, input_shards[infile], shard_idx))
+			input_shards[infile] = shard_idx
+
+		for filename, desc in manifest["outputs"].items():
+			path = os.path.join(shard_dir, filename)
+			if not os.path.isfile(path):
+				problems.append("Output \"{}\" is missing.".format(path))
+			elif not file_matches(path, desc):
+				problems.append("Output \"{}\" does not match its manifest.".format(path))
+			else:
+				output_candidates[filename].append(
+					ShardOutput(path, desc["sha256"], tuple(desc.get("inputs", ())), shard_idx))
+
+		failures_desc = manifest.get("failures")
+		if failures_desc is not None:
+			path = os.path.join(shard_dir, failures_desc["path"])
+			if file_matches(path, failures_desc):
+				failure_reports.append((shard_idx, path))
+			else:
+				problems.append("Failure report \"{}\" is missing or does not match its manifest.".format(path))
+
+	if len(shard_counts) > 1:
+		problems.append("Manifests have different shard counts: {}".format(sorted(shard_counts)))
+	elif shard_counts:
+		shard_count = next(iter(shard_counts))
+		missing_shards = sorted(frozenset(range(shard_count)).difference(shard_dirs_by_index.keys()))
+		if missing_shards:
+			problems.append("Missing manifests for shard(s) {} of {}.".format(missing_shards, shard_count))
+	else:
+		problems.append("No shard manifests found.")
+
+	if problems:
+		raise ValueError("Shards could not be merged:\n" + "\n".join(problems))
+
+	outputs = {}
+	conflicts = []
+	for filename, candidates in output_candidates.items():
+		# Keep the output created from the input which sorts first, as a single unsharded run does
+		kept, *others = sorted(candidates, key=__output_order_key)
+		outputs[filename] = kept
+		for other in others:
+			if other.sha256 != kept.sha256:
+				conflicts.append("Output \"{}\" differs between \"{}\" and \"{}\"; Keeping the former.".format(
+					filename, kept.path, other.path))
+	return MergePlan(sorted(input_shards.keys(), key=natural_keys), outputs,
+					 [path for _, path in sorted(failure_reports)], conflicts)
+
+
+def __output_order_key(output: ShardOutput) -> Tuple[Tuple[Union[int, str], ...], int]:
+	return natural_keys(output.inputs[0]) if output.inputs else (), output.shard_idx
+
+
+def __main(args):
+	if args.debug:
+		logging.basicConfig(level=logging.DEBUG)
+	elif args.info:
+		logging.basicConfig(level=logging.INFO)
+
+	shard_dirs = args.shard_dirs
+	print("Will look for shard manifests under {}.".format(shard_dirs))
+	plan = verify_manifests(find_manifests(shard_dirs))
+	print("Verified {} output file(s) for {} input file(s).".format(len(plan.outputs), len(plan.inputs)))
+	for conflict in plan.conflicts:
+		logging.warning(conflict)
+
+	outdir = args.outdir
+	os.makedirs(outdir, exist_ok=True)
+	outfile_inputs = {}
+	for filename, output in sorted(plan.outputs.items()):
+		outfile_path = os.path.join(outdir, filename)
+		if not os.path.exists(outfile_path) or not os.path.samefile(output.path, outfile_path):
+			logging.info("Copying \"%s\" to \"%s\".", output.path, outfile_path)
+			shutil.copyfile(output.path, outfile_path)
+		outfile_inputs[outfile_path] = output.inputs
+	if plan.failure_reports:
+		failures_path = os.path.join(outdir, "failures.tsv")
+		print("Merging {} failure report(s) into \"{}\".".format(len(plan.failure_reports), failures_path))
+		# The merged report may replace one of the reports being merged
+		with atomic_write(failures_path, newline='') as outf:
+			merge_failure_reports(plan.failure_reports, outf)
+	else:
+		failures_path = None
+	# The merged output is equivalent to the output of a single shard of the entire input
+	manifest_path = write_manifest(outdir, ShardSpec(0, 1), plan.inputs, outfile_inputs, failures_path)
+	print("Finished merging {} file(s) with {} conflict(s); Wrote manifest to \"{}\".".format(len(outfile_inputs),
+																							   len(plan.conflicts),
+																							   manifest_path))
+
+
+if __name__ == "__main__":
+	__main(__create_argparser().parse_args())
@@ -6,8 +6,11 @@ __author__ = "Todd Shore <errantlinguist+github@gmail.com>"
 __copyright__ = "Copyright (C) 2018 Todd Shore"
 __license__ = "Apache License, Version 2.0"
 
+import contextlib
+import os
 import re
-from typing import Optional, Sequence, Tuple, Union
+import uuid
+from typing import IO, Iterator, Optional, Sequence, Tuple, Union
 
 __DIGITS_PATTERN = re.compile('(\d+)')
 
@@ -47,6 +50,30 @@ class Chapter(object):
 		return self.__class__.__name__ + field_repr
 
 
+@contextlib.contextmanager
+def atomic_write(path: str, mode: str = 'w', newline: Optional[str] = None) -> Iterator[IO]:
+	"""
+	Opens a uniquely-named temporary file next to the given path which replaces the file at the path only once it has
+	been completely written, so that neither an interrupted run nor a concurrent one writing the same path can leave a
+	partially-written file there.
+
+	:param path: The path of the file to write.
+	:param mode: The mode to open the temporary file in, e.g. "wb" for writing bytes.
+	:param newline: How to translate newlines when writing text, as for :func:`open`.
+	:return: The open temporary file.
+	"""
+	tmp_path = "{}.{}.tmp".format(path, uuid.uuid4().hex)
+	# Create the file exclusively with the same permissions "open" would give it, i.e. as allowed by the umask
+	fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+	try:
+		with os.fdopen(fd, mode, newline=newline) as outf:
+			yield outf
+		os.replace(tmp_path, path)
+	except BaseException:
+		os.remove(tmp_path)
+		raise
+
+
 def natural_keys(text: str) -> Tuple[Union[int, str], ...]:
 	"""
 	alist.sort(key=natural_keys) sorts in human order
@@ -0,0 +1,401 @@
+"""
+Functionalities for counting tokens and persisting the counts so that they can later be updated incrementally.
+"""
+
+__author__ = "Todd Shore <errantlinguist+github@gmail.com>"
+__copyright__ = "Copyright (C) 2018 Todd Shore"
+__license__ = "Apache License, Version 2.0"
+
+import heapq
+import os
+import struct
+import sys
+from array import array
+from collections import namedtuple
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+from . import atomic_write
+
+STORE_MAGIC = b"SGTC"
+STORE_VERSION = 1
+
+_ID_TYPECODE = "I"
+_COUNT_TYPECODE = "I"
+_HEADER_STRUCT = struct.Struct("<4sI")
+_LENGTH_STRUCT = struct.Struct("<Q")
+_FINGERPRINT_STRUCT = struct.Struct("<Qq")
+
+FileFingerprint = namedtuple("FileFingerprint", "size mtime_ns")
+_FileCounts = namedtuple("_FileCounts", "fingerprint ids counts")
+
+
+class Vocabulary(object):
+	"""
+	A mapping of token types to contiguous integer IDs, each type being stored only once.
+	"""
+
+	def __init__(self, tokens: Iterable[str] = ()):
+		self.tokens = []  # type: List[str]
+		self.__ids = {}  # type: Dict[str, int]
+		for token in tokens:
+			self.intern(token)
+
+	def __contains__(self, token: str) -> bool:
+		return token in self.__ids
+
+	def __getitem__(self, token: str) -> int:
+		return self.__ids[token]
+
+	def __iter__(self) -> Iterator[str]:
+		return iter(self.tokens)
+
+	def __len__(self) -> int:
+		return len(self.tokens)
+
+	def get(self, token: str, default: Optional[int] = None) -> Optional[int]:
+		return self.__ids.get(token, default)
+
+	def intern(self, token: str) -> int:
+		"""
+		:param token: The token type to look up.
+		:return: The ID of the given type, adding it to the vocabulary if it is not yet present.
+		"""
+		try:
+			result = self.__ids[token]
+		except KeyError:
+			result = len(self.tokens)
+			self.__ids[token] = result
+			self.tokens.append(token)
+		return result
+
+
+class MisraGriesCounter(object):
+	"""
+	Approximately counts the most frequent token types using a bounded number of counters.
+
+	Any token type occurring more than N / (capacity + 1) times in a stream of N tokens is guaranteed to be kept, and each
+	kept count underestimates the true count by at most that amount. Counters are reduced in batches so that the amortized
+	cost of each update is constant; As a result, up to twice the capacity is held in memory between reductions.
+
+	:see: https://doi.org/10.1016/0167-6423(82)90012-0
+	"""
+
+	def __init__(self, capacity: int):
+		"""
+		:param capacity: The number of token types to keep after each reduction.
+		"""
+		if capacity < 1:
+			raise ValueError("Capacity must be positive but was {}.".format(capacity))
+		self.capacity = capacity
+		self.counts = {}  # type: Dict[str, int]
+
+	def __len__(self) -> int:
+		return len(self.counts)
+
+	def update(self, tokens: Iterable[str]):
+		counts = self.counts
+		max_size = self.capacity * 2
+		for token in tokens:
+			try:
+				counts[token] += 1
+			except KeyError:
+				counts[token] = 1
+				if len(counts) > max_size:
+					self.__reduce()
+					counts = self.counts
+
+	def __reduce(self):
+		# Subtract the count of the first type not to be kept so that at most "capacity" types remain
+		decrement = heapq.nlargest(self.capacity + 1, self.counts.values())[-1]
+		self.counts = {token: count - decrement for token, count in self.counts.items() if count > decrement}
+
+
+class NGramCounter(object):
+	"""
+	Counts token n-grams up to a given order as well as, optionally, the number of documents each token type occurs in.
+
+	Unigram counts and document frequencies are stored as arrays indexed by vocabulary ID while higher-order n-grams are
+	stored as tuples of vocabulary IDs.
+	"""
+
+	def __init__(self, order: int, vocab: Optional[Vocabulary] = None, count_doc_freqs: bool = True):
+		"""
+		:param order: The maximum n-gram length to count.
+		:param vocab: The vocabulary to use for encoding tokens.
+		:param count_doc_freqs: If True, also count the number of documents each token type occurs in.
+		"""
+		if order < 1:
+			raise ValueError("N-gram order must be positive but was {}.".format(order))
+		self.order = order
+		self.vocab = Vocabulary() if vocab is None else vocab
+		self.unigram_counts = array("Q", bytes(array("Q").itemsize * len(self.vocab)))
+		self.doc_freqs = array("Q", self.unigram_counts) if count_doc_freqs else None
+		self.ngram_counts = tuple({} for _ in range(2, order + 1))  # type: Tuple[Dict[Tuple[int, ...], int], ...]
+
+	def add_document(self, token_seqs: Iterable[Sequence[str]]):
+		"""
+		:param token_seqs: The token sequences in the document, e.g. one for each paragraph; N-grams are not counted across sequences.
+		"""
+		doc_freqs = self.doc_freqs
+		doc_token_ids = set()
+		for tokens in token_seqs:
+			token_ids = tuple(self.__intern(token) for token in tokens)
+			if doc_freqs is not None:
+				doc_token_ids.update(token_ids)
+			for token_id in token_ids:
+				self.unigram_counts[token_id] += 1
+			for n, counts in enumerate(self.ngram_counts, start=2):
+				for start in range(len(token_ids) - n + 1):
+					ngram = token_ids[start:start + n]
+					try:
+						counts[ngram] += 1
+					except KeyError:
+						counts[ngram] = 1
+		for token_id in doc_token_ids:
+			doc_freqs[token_id] += 1
+
+	def counts(self, n: int) -> Dict[Tuple[str, ...], int]:
+		"""
+		:param n: The length of the n-grams to get.
+		:return: The count of each n-gram of the given length, with each n-gram represented as a tuple of token strings.
+		"""
+		tokens = self.vocab.tokens
+		if n == 1:
+			result = {(token,): count for token, count in zip(tokens, self.unigram_counts) if count > 0}
+		else:
+			result = {tuple(tokens[token_id] for token_id in ngram): count for ngram, count in
+					  self.ngram_counts[n - 2].items()}
+		return result
+
+	def document_frequencies(self) -> Dict[str, int]:
+		if self.doc_freqs is None:
+			raise ValueError("Document frequencies were not counted.")
+		return {token: doc_freq for token, doc_freq in zip(self.vocab.tokens, self.doc_freqs) if doc_freq > 0}
+
+	def pruned_counts(self, n: int, min_count: int = 1, top_k: Optional[int] = None) -> List[Tuple[Tuple[str, ...], int]]:
+		"""
+		Prunes the counts of n-grams of the given length while they are still represented as vocabulary IDs, only
+		converting the n-grams which are kept to token strings.
+
+		:param n: The length of the n-grams to get.
+		:param min_count: The minimum count an n-gram must have in order to be kept.
+		:param top_k: If not None, the maximum number of n-grams to keep.
+		:return: A list of n-gram-count pairs ordered as by :func:`prune_counts`.
+		"""
+		if n == 1:
+			return prune_counts(self.counts(1), min_count, top_k)
+
+		id_counts = self.ngram_counts[n - 2]
+		threshold = min_count
+		if top_k is not None and 0 < top_k < len(id_counts):
+			# Keep every n-gram tied with the k-th most frequent one so that ties are broken by the token strings
+			threshold = max(threshold, heapq.nlargest(top_k, id_counts.values())[-1])
+		tokens = self.vocab.tokens
+		candidates = {tuple(tokens[token_id] for token_id in ngram): count for ngram, count in id_counts.items() if
+					  count >= threshold}
+		return prune_counts(candidates, min_count, top_k)
+
+	def token_counts(self) -> Dict[str, int]:
+		return {token: count for token, count in zip(self.vocab.tokens, self.unigram_counts) if count > 0}
+
+	def __intern(self, token: str) -> int:
+		result = self.vocab.intern(token)
+		while result >= len(self.unigram_counts):
+			self.unigram_counts.append(0)
+			if self.doc_freqs is not None:
+				self.doc_freqs.append(0)
+		return result
+
+
+class TokenCountStore(object):
+	"""
+	Token counts for each file read, stored as vectors of vocabulary IDs and their corresponding counts.
+	"""
+
+	def __init__(self, vocab: Optional[Vocabulary] = None):
+		self.vocab = Vocabulary() if vocab is None else vocab
+		self.__file_counts = {}  # type: Dict[str, _FileCounts]
+
+	def __contains__(self, path: str) -> bool:
+		return path in self.__file_counts
+
+	def __iter__(self) -> Iterator[str]:
+		return iter(self.__file_counts)
+
+	def __len__(self) -> int:
+		return len(self.__file_counts)
+
+	def file_counts(self, path: str) -> Iterator[Tuple[str, int]]:
+		file_counts = self.__file_counts[path]
+		tokens = self.vocab.tokens
+		return ((tokens[token_id], count) for token_id, count in zip(file_counts.ids, file_counts.counts))
+
+	def is_current(self, path: str) -> bool:
+		"""
+		:param path: The path of the file to check.
+		:return: True iff counts for the given file are stored and the file has not changed since they were counted.
+		"""
+		file_counts = self.__file_counts.get(path)
+		if file_counts is None:
+			result = False
+		else:
+			try:
+				result = file_counts.fingerprint == create_file_fingerprint(path)
+			except OSError:
+				result = False
+		return result
+
+	def merge(self, other: "TokenCountStore"):
+		"""
+		Adds the counts for all files in another store to this one, replacing the counts for any file present in both.
+
+		:param other: The store to merge into this one.
+		"""
+		id_map = array(_ID_TYPECODE, (self.vocab.intern(token) for token in other.vocab.tokens))
+		for path, file_counts in other.__file_counts.items():
+			ids = array(_ID_TYPECODE, (id_map[token_id] for token_id in file_counts.ids))
+			self.__file_counts[path] = _FileCounts(file_counts.fingerprint, ids, array(_COUNT_TYPECODE, file_counts.counts))
+
+	def put(self, path: str, counts: Mapping[str, int], fingerprint: Optional[FileFingerprint] = None):
+		"""
+		:param path: The path of the file which was counted.
+		:param counts: The count of each token type in the file.
+		:param fingerprint: The fingerprint of the file at the time it was counted; If not given, it is read from the file system.
+		"""
+		if fingerprint is None:
+			fingerprint = create_file_fingerprint(path)
+		ids = array(_ID_TYPECODE, (self.vocab.intern(token) for token in counts.keys()))
+		self.__file_counts[path] = _FileCounts(fingerprint, ids, array(_COUNT_TYPECODE, counts.values()))
+
+	def remove(self, path: str):
+		del self.__file_counts[path]
+
+	def document_frequencies(self) -> Dict[str, int]:
+		"""
+		:return: The number of files each token type occurs in.
+		"""
+		doc_freqs = array("Q", bytes(array("Q").itemsize * len(self.vocab)))
+		for file_counts in self.__file_counts.values():
+			for token_id in file_counts.ids:
+				doc_freqs[token_id] += 1
+		return {token: doc_freq for token, doc_freq in zip(self.vocab.tokens, doc_freqs) if doc_freq > 0}
+
+	def total_counts(self) -> Dict[str, int]:
+		"""
+		:return: The count of each token type summed over all files.
+		"""
+		totals = array("Q", bytes(array("Q").itemsize * len(self.vocab)))
+		for file_counts in self.__file_counts.values():
+			for token_id, count in zip(file_counts.ids, file_counts.counts):
+				totals[token_id] += count
+		return {token: count for token, count in zip(self.vocab.tokens, totals) if count > 0}
+
+	@classmethod
+	def load(cls, path: str) -> "TokenCountStore":
+		with open(path, "rb") as inf:
+			return cls.read(inf)
+
+	@classmethod
+	def read(cls, inf: BinaryIO) -> "TokenCountStore":
+		magic, version = _HEADER_STRUCT.unpack(inf.read(_HEADER_STRUCT.size))
+		if magic != STORE_MAGIC:
+			raise ValueError("Not a token count store.")
+		if version != STORE_VERSION:
+			raise ValueError("Unsupported token count store version: {}".format(version))
+
+		tokens = _read_strings(inf)
+		result = cls(Vocabulary(tokens))
+		if len(result.vocab) != len(tokens):
+			raise ValueError("Token count store contains duplicate token types.")
+		paths = _read_strings(inf)
+		for path in paths:
+			size, mtime_ns = _FINGERPRINT_STRUCT.unpack(inf.read(_FINGERPRINT_STRUCT.size))
+			ids = _read_array(inf, _ID_TYPECODE)
+			counts = _read_array(inf, _COUNT_TYPECODE)
+			if len(ids) != len(counts):
+				raise ValueError("Count vector for \"{}\" is corrupt.".format(path))
+			result.__file_counts[path] = _FileCounts(FileFingerprint(size, mtime_ns), ids, counts)
+		return result
+
+	def save(self, path: str):
+		with atomic_write(path, "wb") as outf:
+			self.write(outf)
+
+	def write(self, outf: BinaryIO):
+		outf.write(_HEADER_STRUCT.pack(STORE_MAGIC, STORE_VERSION))
+		_write_strings(self.vocab.tokens, outf)
+		paths = tuple(self.__file_counts.keys())
+		_write_strings(paths, outf)
+		for path in paths:
+			file_counts = self.__file_counts[path]
+			outf.write(_FINGERPRINT_STRUCT.pack(*file_counts.fingerprint))
+			_write_array(file_counts.ids, outf)
+			_write_array(file_counts.counts, outf)
+
+
+def create_file_fingerprint(path: str) -> FileFingerprint:
+	stat = os.stat(path)
+	return FileFingerprint(stat.st_size, stat.st_mtime_ns)
+
+
+def prune_counts(counts: Mapping[Any, int], min_count: int = 1, top_k: Optional[int] = None) -> List[
+	Tuple[Any, int]]:
+	"""
+	Orders token counts by descending count and then by token, sorting the vocabulary only once.
+
+	:param counts: The count of each token type or n-gram.
+	:param min_count: The minimum count a token type must have in order to be kept.
+	:param top_k: If not None, the maximum number of token types to keep.
+	:return: A list of token-count pairs.
+	"""
+	items = ((token, count) for token, count in counts.items() if count >= min_count)
+	key = __count_order_key
+	if top_k is None:
+		result = sorted(items, key=key)
+	else:
+		result = heapq.nsmallest(top_k, items, key=key)
+	return result
+
+
+def __count_order_key(item: Tuple[Any, int]) -> Tuple[int, Any]:
+	return -item[1], item[0]
+
+
+def _read_array(inf: BinaryIO, typecode: str) -> array:
+	length, = _LENGTH_STRUCT.unpack(inf.read(_LENGTH_STRUCT.size))
+	result = array(typecode)
+	result.frombytes(inf.read(length * result.itemsize))
+	if len(result) != length:
+		raise ValueError("Token count store is truncated.")
+	if sys.byteorder != "little":
+		result.byteswap()
+	return result
+
+
+def _read_strings(inf: BinaryIO) -> List[str]:
+	lengths = _read_array(inf, "I")
+	data = inf.read(sum(lengths))
+	result = []
+	start = 0
+	for length in lengths:
+		end = start + length
+		result.append(data[start:end].decode("utf-8"))
+		start = end
+	if start != len(data):
+		raise ValueError("Token count store is truncated.")
+	return result
+
+
+def _write_array(values: array, outf: BinaryIO):
+	outf.write(_LENGTH_STRUCT.pack(len(values)))
+	if sys.byteorder != "little":
+		values = array(values.typecode, values)
+		values.byteswap()
+	outf.write(values.tobytes())
+
+
+def _write_strings(strs: Iterable[str], outf: BinaryIO):
+	encoded = tuple(s.encode("utf-8") for s in strs)
+	_write_array(array("I", (len(s) for s in encoded)), outf)
+	for s in encoded:
+		outf.write(s)
@@ -0,0 +1,213 @@
+"""
+Functionalities for finding near-duplicate chapters and books using MinHash signatures and locality-sensitive hashing.
+
+:see: https://doi.org/10.1109/SEQUEN.1997.666900
+"""
+
+__author__ = "Todd Shore <errantlinguist+github@gmail.com>"
+__copyright__ = "Copyright (C) 2018 Todd Shore"
+__license__ = "Apache License, Version 2.0"
+
+import itertools
+import zlib
+from collections import defaultdict, namedtuple
+from typing import DefaultDict, Dict, Hashable, Iterable, Iterator, List, Sequence, Set, Tuple
+
+import numpy as np
+
+from . import Chapter
+
+NEAR_DUPLICATE_RELATION = "near-duplicate"
+CONTAINED_RELATION = "contained-in"
+
+# The largest prime less than 2^32, which ensures that "a * x + b" never overflows 64 bits for 32-bit hashes
+_HASH_PRIME = np.uint64(4294967291)
+_MAX_HASH = np.uint64(4294967295)
+
+ChapterKey = namedtuple("ChapterKey", "book idx")
+DuplicateReport = namedtuple("DuplicateReport", "chapter_pairs book_pairs redundant_chapters")
+
+
+class MinHasher(object):
+
+	def __init__(self, num_perm: int = 128, shingle_size: int = 5, seed: int = 0, max_chunk_size: int = 4096):
+		"""
+		:param num_perm: The number of hash permutations, i.e. the length of each signature.
+		:param shingle_size: The number of consecutive words in each shingle.
+		:param seed: The random seed used for creating the permutations; Signatures are only comparable if created with the same seed.
+		:param max_chunk_size: The maximum number of shingles to permute at once, limiting the size of the intermediate matrix.
+		"""
+		self.num_perm = num_perm
+		self.shingle_size = shingle_size
+		self.max_chunk_size = max_chunk_size
+		rnd = np.random.RandomState(seed)
+		self.__a = rnd.randint(1, int(_HASH_PRIME), size=(num_perm, 1), dtype=np.uint64)
+		self.__b = rnd.randint(0, int(_HASH_PRIME), size=(num_perm, 1), dtype=np.uint64)
+
+	def __call__(self, pars: Iterable[str]) -> np.ndarray:
+		"""
+		:param pars: The paragraphs of text to shingle; Shingles do not cross paragraph boundaries.
+		:return: The MinHash signature of the shingles; Empty text has a signature consisting only of the maximum hash value.
+		"""
+		shingle_hashes = np.unique(np.fromiter(self.__hash_shingles(pars), dtype=np.uint64))
+		result = np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+		for start in range(0, len(shingle_hashes), self.max_chunk_size):
+			chunk = shingle_hashes[start:start + self.max_chunk_size]
+			permuted = (self.__a * chunk + self.__b) % _HASH_PRIME
+			np.minimum(result, permuted.min(axis=1), out=result)
+		return result
+
+	def __hash_shingles(self, pars: Iterable[str]) -> Iterator[int]:
+		shingle_size = self.shingle_size
+		for par in pars:
+			tokens = par.lower().split()
+			if len(tokens) <= shingle_size:
+				if tokens:
+					yield zlib.crc32(" ".join(tokens).encode("utf-8"))
+			else:
+				for start in range(len(tokens) - shingle_size + 1):
+					yield zlib.crc32(" ".join(tokens[start:start + shingle_size]).encode("utf-8"))
+
+
+class LSHIndex(object):
+	"""
+	Finds pairs of signatures which are likely to have at least a given similarity by hashing bands of each signature.
+	"""
+
+	def __init__(self, num_perm: int, threshold: float):
+		"""
+		:param num_perm: The length of the signatures to index.
+		:param threshold: The estimated Jaccard similarity at or above which pairs of signatures are considered duplicates.
+		"""
+		self.threshold = threshold
+		self.band_count, self.rows_per_band = optimal_band_shape(num_perm, threshold)
+		self.__buckets = defaultdict(list)  # type: DefaultDict[Tuple[int, bytes], List[Hashable]]
+		self.__signatures = {}  # type: Dict[Hashable, np.ndarray]
+
+	def __len__(self) -> int:
+		return len(self.__signatures)
+
+	def add(self, key: Hashable, signature: np.ndarray):
+		if key in self.__signatures:
+			raise ValueError("Key already indexed: {}".format(key))
+		self.__signatures[key] = signature
+		rows = self.rows_per_band
+		for band_idx in range(self.band_count):
+			band = signature[band_idx * rows:(band_idx + 1) * rows]
+			self.__buckets[band_idx, band.tobytes()].append(key)
+
+	def duplicate_pairs(self) -> Iterator[Tuple[Hashable, Hashable, float]]:
+		"""
+		:return: Each pair of keys whose estimated similarity is at least the threshold, in the order they were added, together with that similarity.
+		"""
+		candidate_pairs = set()  # type: Set[Tuple[Hashable, Hashable]]
+		for keys in self.__buckets.values():
+			candidate_pairs.update(itertools.combinations(keys, 2))
+		order = {key: idx for idx, key in enumerate(self.__signatures)}
+		for first, second in sorted(candidate_pairs, key=lambda pair: (order[pair[0]], order[pair[1]])):
+			similarity = estimate_similarity(self.__signatures[first], self.__signatures[second])
+			if similarity >= self.threshold:
+				yield first, second, similarity
+
+
+def find_duplicates(books: Iterable[Tuple[str, Sequence[Chapter]]], hasher: MinHasher,
+					threshold: float) -> DuplicateReport:
+	"""
+	Finds near-duplicate chapters as well as books which are either near-duplicates of each other as a whole, e.g.
+	different editions of the same book, or for which most chapters are contained in another book, e.g. in an omnibus.
+
+	:param books: Pairs of book titles and their chapters, in order of preference for keeping them.
+	:param hasher: The hasher to create chapter signatures with.
+	:param threshold: The minimum similarity for chapters or books to be considered duplicates, which is also the minimum proportion of the chapters of a book which must be duplicated in another in order for it to be contained therein.
+	:return: A report containing triples of each pair of duplicate chapters with their estimated similarity; Quadruples of each pair of related books with their relation and similarity; And the chapters which duplicate a chapter preceding them and so can be removed.
+	"""
+	chapter_index = LSHIndex(hasher.num_perm, threshold)
+	book_index = LSHIndex(hasher.num_perm, threshold)
+	book_chapter_counts = {}
+	for book_title, chapters in books:
+		chapter_sigs = []
+		for idx, chapter in enumerate(chapters):
+			sig = hasher(chapter.pars)
+			if (sig != _MAX_HASH).any():
+				chapter_index.add(ChapterKey(book_title, idx), sig)
+				chapter_sigs.append(sig)
+		book_chapter_counts[book_title] = len(chapter_sigs)
+		if chapter_sigs:
+			# The signature of the union of all chapters is the element-wise minimum of the chapter signatures
+			book_index.add(book_title, np.minimum.reduce(chapter_sigs))
+
+	chapter_pairs = tuple(chapter_index.duplicate_pairs())
+	book_pairs = [(first, second, NEAR_DUPLICATE_RELATION, similarity) for first, second, similarity in
+				  book_index.duplicate_pairs()]
+	book_pairs.extend(__find_contained_books(chapter_pairs, book_chapter_counts, threshold,
+											 frozenset((first, second) for first, second, _, _ in book_pairs)))
+	return DuplicateReport(chapter_pairs, book_pairs, __find_redundant_chapters(chapter_pairs))
+
+
+def estimate_similarity(first: np.ndarray, second: np.ndarray) -> float:
+	"""
+	:return: The Jaccard similarity of the shingle sets represented by the two given MinHash signatures.
+	"""
+	return float(np.mean(first == second))
+
+
+def optimal_band_shape(num_perm: int, threshold: float, false_positive_weight: float = 0.1,
+					   false_negative_weight: float = 0.9, integration_steps: int = 200) -> Tuple[int, int]:
+	"""
+	Finds the division of (a prefix of) a signature into bands which minimizes the weighted probabilities of a pair
+	below the threshold becoming a candidate and of a pair at or above it not becoming one, each integrated over the
+	similarities on its side of the threshold. False negatives are weighted more heavily by default because
+	candidates are checked against the threshold anyway while missed pairs are lost.
+
+	:param num_perm: The length of the signatures.
+	:param threshold: The desired similarity threshold.
+	:param false_positive_weight: The weight of the probability of false positives.
+	:param false_negative_weight: The weight of the probability of false negatives.
+	:param integration_steps: The number of points to evaluate each probability at when integrating it.
+	:return: A pair of the band count and the number of rows in each band, whose product is at most the signature length.
+	"""
+	# Midpoints of equal-width intervals on either side of the threshold
+	steps = (np.arange(integration_steps) + 0.5) / integration_steps
+	below = steps * threshold
+	above = threshold + steps * (1.0 - threshold)
+	best_shape = None
+	best_error = None
+	for band_count in range(1, num_perm + 1):
+		for rows in range(1, num_perm // band_count + 1):
+			false_positives = __candidate_probability(below, band_count, rows).mean() * threshold
+			false_negatives = (1.0 - __candidate_probability(above, band_count, rows)).mean() * (1.0 - threshold)
+			error = false_positive_weight * false_positives + false_negative_weight * false_negatives
+			if best_error is None or error < best_error:
+				best_shape = band_count, rows
+				best_error = error
+	return best_shape
+
+
+def __candidate_probability(similarities: np.ndarray, band_count: int, rows: int) -> np.ndarray:
+	# The probability that at least one band of a pair with the given similarity is identical
+	return 1.0 - (1.0 - similarities ** rows) ** band_count
+
+
+def __find_contained_books(chapter_pairs: Iterable[Tuple[ChapterKey, ChapterKey, float]],
+						   book_chapter_counts: Dict[str, int], threshold: float,
+						   near_duplicate_books: Set[Tuple[str, str]]) -> Iterator[Tuple[str, str, str, float]]:
+	duplicated_chapters = defaultdict(set)  # type: DefaultDict[Tuple[str, str], Set[int]]
+	for first, second, _ in chapter_pairs:
+		if first.book != second.book:
+			duplicated_chapters[first.book, second.book].add(first.idx)
+			duplicated_chapters[second.book, first.book].add(second.idx)
+	for (contained_book, containing_book), chapter_idxs in duplicated_chapters.items():
+		if (contained_book, containing_book) not in near_duplicate_books and (
+				containing_book, contained_book) not in near_duplicate_books:
+			containment = len(chapter_idxs) / book_chapter_counts[contained_book]
+			if containment >= threshold:
+				yield contained_book, containing_book, CONTAINED_RELATION, containment
+
+
+def __find_redundant_chapters(chapter_pairs: Iterable[Tuple[ChapterKey, ChapterKey, float]]) -> Set[ChapterKey]:
+	# Pairs are ordered by when their chapters were added, so the first chapter of each pair is preferred
+	result = set()
+	for first, second, _ in chapter_pairs:
+		if first not in result:
+			result.add(second)
+	return result
@@ -0,0 +1,123 @@
+"""
+Functionalities for encoding text as arrays of token IDs which can be used directly for training.
+"""
+
+__author__ = "Todd Shore <errantlinguist+github@gmail.com>"
+__copyright__ = "Copyright (C) 2018 Todd Shore"
+__license__ = "Apache License, Version 2.0"
+
+import csv
+from collections import namedtuple
+from typing import Callable, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from . import Chapter
+from .counts import Vocabulary
+
+OOV_TOKEN = "<unk>"
+OOV_ID = 0
+TOKEN_ID_DTYPE = np.int32
+OFFSET_DTYPE = np.int64
+
+# A flat array of token IDs together with the boundaries of the paragraphs, chapters and books therein: Each offset
+# array has one element more than the number of units it describes, the last being the end of the last unit, i.e.
+# paragraph i spans "token_ids[par_offsets[i]:par_offsets[i + 1]]", chapter j spans paragraphs
+# "chapter_offsets[j]:chapter_offsets[j + 1]" and book k spans chapters "book_offsets[k]:book_offsets[k + 1]"
+EncodedShard = namedtuple("EncodedShard", "token_ids par_offsets chapter_offsets book_offsets")
+
+_SHARD_ARRAY_NAMES = EncodedShard._fields
+
+
+class ShardEncoder(object):
+
+	def __init__(self, vocab: Vocabulary, tokenizer: Callable[[str], Sequence[str]], batch_size: int = 65536):
+		"""
+		:param vocab: The vocabulary to encode tokens with; Any token not in it is encoded as :data:`OOV_ID`.
+		:param tokenizer: The function to use for splitting a paragraph into tokens.
+		:param batch_size: The (approximate) number of tokens to encode at once.
+		"""
+		if len(vocab) > np.iinfo(TOKEN_ID_DTYPE).max:
+			raise ValueError("Vocabulary of size {} is too big to be encoded as {}.".format(len(vocab), TOKEN_ID_DTYPE))
+		self.vocab = vocab
+		self.tokenizer = tokenizer
+		self.batch_size = batch_size
+
+	def __call__(self, books: Iterable[Iterable[Chapter]]) -> EncodedShard:
+		"""
+		:param books: The chapters of each book to encode.
+		:return: The encoded books.
+		"""
+		encoded_batches = []  # type: List[np.ndarray]
+		batch = []  # type: List[str]
+		token_count = 0
+		par_offsets = [0]
+		chapter_offsets = [0]
+		book_offsets = [0]
+		for chapters in books:
+			for chapter in chapters:
+				for par in chapter.pars:
+					tokens = self.tokenizer(par)
+					batch.extend(tokens)
+					token_count += len(tokens)
+					par_offsets.append(token_count)
+					if len(batch) >= self.batch_size:
+						encoded_batches.append(self.__encode_batch(batch))
+						batch = []
+				chapter_offsets.append(len(par_offsets) - 1)
+			book_offsets.append(len(chapter_offsets) - 1)
+		if batch:
+			encoded_batches.append(self.__encode_batch(batch))
+
+		token_ids = np.concatenate(encoded_batches) if encoded_batches else np.empty(0, dtype=TOKEN_ID_DTYPE)
+		return EncodedShard(token_ids, np.array(par_offsets, dtype=OFFSET_DTYPE),
+							np.array(chapter_offsets, dtype=OFFSET_DTYPE), np.array(book_offsets, dtype=OFFSET_DTYPE))
+
+	def __encode_batch(self, tokens: Sequence[str]) -> np.ndarray:
+		# Look up each distinct type only once and then map the IDs back onto the tokens using array indexing
+		types, inverse = np.unique(np.array(tokens, dtype=object), return_inverse=True)
+		vocab = self.vocab
+		type_ids = np.fromiter((vocab.get(token, OOV_ID) for token in types), dtype=TOKEN_ID_DTYPE, count=len(types))
+		return type_ids[inverse]
+
+
+def load_shard(path_prefix: str, mmap_mode: Optional[str] = "r") -> EncodedShard:
+	"""
+	:param path_prefix: The path prefix the shard arrays were saved with.
+	:param mmap_mode: The mode to memory-map the arrays with (see :func:`numpy.load`) or None to read them into memory.
+	:return: The loaded shard.
+	"""
+	return EncodedShard(*(np.load(__create_array_path(path_prefix, name), mmap_mode=mmap_mode) for name in
+						  _SHARD_ARRAY_NAMES))
+
+
+def read_lexicon(lines: Iterable[str]) -> Vocabulary:
+	"""
+	Creates a vocabulary from a lexicon in the tab-separated format written by "write_token_counts.py": The type in the
+	first column of the first data row is given the ID following :data:`OOV_ID`, the second the next, etc.
+
+	:param lines: The lines of the lexicon, including its header row.
+	:return: A vocabulary with :data:`OOV_TOKEN` as its first type.
+	"""
+	reader = csv.reader(lines, dialect=csv.excel_tab)
+	# Skip the header
+	next(reader)
+	result = Vocabulary((OOV_TOKEN,))
+	for row in reader:
+		result.intern(row[0])
+	return result
+
+
+def save_shard(shard: EncodedShard, path_prefix: str):
+	"""
+	Saves each array of a shard as a separate ".npy" file so that it can later be memory-mapped.
+
+	:param shard: The shard to save.
+	:param path_prefix: The path prefix to save the arrays with, e.g. "shard-00000" for "shard-00000.token_ids.npy".
+	"""
+	for name, arr in zip(_SHARD_ARRAY_NAMES, shard):
+		np.save(__create_array_path(path_prefix, name), arr)
+
+
+def __create_array_path(path_prefix: str, name: str) -> str:
+	return "{}.{}.npy".format(path_prefix, name)
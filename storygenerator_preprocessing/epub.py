@@ -0,0 +1,115 @@
+"""
+Functionalities for reading EPUB archives <http://idpf.org/epub> lazily, decompressing only the parts which are actually used.
+"""
+
+__author__ = "Todd Shore <errantlinguist+github@gmail.com>"
+__copyright__ = "Copyright (C) 2018 Todd Shore"
+__license__ = "Apache License, Version 2.0"
+
+import posixpath
+import urllib.parse
+import xml.etree.ElementTree as ElementTree
+import zipfile
+from typing import BinaryIO, Dict, Optional, Tuple, Union
+
+CONTAINER_PATH = "META-INF/container.xml"
+NCX_MEDIA_TYPE = "application/x-dtbncx+xml"
+
+_CONTAINER_NAMESPACES = {"container": "urn:oasis:names:tc:opendocument:xmlns:container"}
+_OPF_NAMESPACES = {"dc": "http://purl.org/dc/elements/1.1/", "opf": "http://www.idpf.org/2007/opf"}
+
+
+class MalformedEPUBError(ValueError):
+	"""
+	Raised when an EPUB archive does not have the structure required for reading it.
+	"""
+	pass
+
+
+class EPUBArchive(object):
+	"""
+	An EPUB archive from which only the package metadata is read up front; The navigation and content documents are only
+	decompressed when they are opened.
+	"""
+
+	def __init__(self, file: Union[str, BinaryIO]):
+		"""
+		:param file: The path of the archive or a seekable binary stream of its content.
+		"""
+		self.__zip = zipfile.ZipFile(file)
+		try:
+			opf_path = self.__read_rootfile_path()
+			self.__opf_dir = posixpath.dirname(opf_path)
+			self.title, self.__ncx_href = self.__read_package(opf_path)
+		except Exception:
+			self.__zip.close()
+			raise
+
+	def __enter__(self) -> "EPUBArchive":
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.close()
+
+	def close(self):
+		self.__zip.close()
+
+	def open_document(self, href: str) -> BinaryIO:
+		"""
+		:param href: The reference to the document relative to the package document, e.g. from a navigation point.
+		:return: A stream of the (decompressed) document content.
+		:raises MalformedEPUBError: If the archive does not contain the document.
+		"""
+		return self.__open_member(self.__resolve_href(href))
+
+	def open_navigation(self) -> BinaryIO:
+		"""
+		:return: A stream of the NCX navigation document content.
+		"""
+		return self.open_document(self.__ncx_href)
+
+	def __open_member(self, path: str) -> BinaryIO:
+		try:
+			return self.__zip.open(path)
+		except KeyError:
+			raise MalformedEPUBError("No file \"{}\" found in archive.".format(path))
+
+	def __parse_member(self, path: str) -> ElementTree.Element:
+		with self.__open_member(path) as inf:
+			try:
+				return ElementTree.parse(inf).getroot()
+			except ElementTree.ParseError as e:
+				raise MalformedEPUBError("Could not parse \"{}\": {}".format(path, e))
+
+	def __read_package(self, opf_path: str) -> Tuple[str, str]:
+		package = self.__parse_member(opf_path)
+
+		title_elem = package.find("opf:metadata/dc:title", _OPF_NAMESPACES)
+		if title_elem is None or not title_elem.text:
+			raise MalformedEPUBError("No title found in package document \"{}\".".format(opf_path))
+
+		manifest_hrefs = {}  # type: Dict[str, str]
+		ncx_href = None  # type: Optional[str]
+		for item in package.iterfind("opf:manifest/opf:item", _OPF_NAMESPACES):
+			href = item.get("href")
+			manifest_hrefs[item.get("id")] = href
+			if ncx_href is None and item.get("media-type") == NCX_MEDIA_TYPE:
+				ncx_href = href
+		spine = package.find("opf:spine", _OPF_NAMESPACES)
+		if spine is not None and spine.get("toc") in manifest_hrefs:
+			ncx_href = manifest_hrefs[spine.get("toc")]
+		if ncx_href is None:
+			raise MalformedEPUBError("No NCX navigation document found in package document \"{}\".".format(opf_path))
+
+		return title_elem.text, ncx_href
+
+	def __read_rootfile_path(self) -> str:
+		container = self.__parse_member(CONTAINER_PATH)
+		rootfile = container.find("container:rootfiles/container:rootfile", _CONTAINER_NAMESPACES)
+		if rootfile is None or not rootfile.get("full-path"):
+			raise MalformedEPUBError("No package document referenced in container file.")
+		return rootfile.get("full-path")
+
+	def __resolve_href(self, href: str) -> str:
+		path = urllib.parse.unquote(href)
+		return posixpath.normpath(posixpath.join(self.__opf_dir, path))
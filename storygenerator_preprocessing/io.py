@@ -6,17 +6,22 @@ __author__ = "Todd Shore <errantlinguist+github@gmail.com>"
 __copyright__ = "Copyright (C) 2018 Todd Shore"
 __license__ = "Apache License, Version 2.0"
 
+import io
 import itertools
 import logging
 import re
+import time
+import zipfile
 from collections import defaultdict, namedtuple
-from typing import DefaultDict, Dict, IO, Iterable, Iterator, List, Mapping, MutableSequence, Sequence, Tuple, Union
+from typing import BinaryIO, Callable, DefaultDict, Dict, IO, Iterable, Iterator, List, Mapping, MutableSequence, \
+	Optional, Sequence, Tuple, Union
 
 import bs4
-import ebooklib
-from ebooklib import epub
+import ebooklib.epub
 
 from . import Chapter, natural_keys
+from .epub import EPUBArchive, MalformedEPUBError
+from .structure import ChapterStructureCache, fingerprint_structure
 
 PROLOGUE_TITLE = "prologue"
 EPILOGUE_TITLE = "epilogue"
@@ -28,16 +33,27 @@ MULTI_BOOK_END_PAR_PATTERNS = tuple(
 	re.compile(regex, re.IGNORECASE) for regex in ("The\\s+End", "of\\s+the\\s+(?:\\w+)\\s+Book\\s+of"))
 CHAPTER_DELIM = "=" * 64
 CHAPTER_HEADER_PATTERN = re.compile("CHAPTER\\s*(\\d+)?", re.IGNORECASE)
+_CHAPTER_TITLE_DELIM = ": "
 TITLE_BLACKLIST = frozenset(("cover", "cover page", "title", "title page", "copyright", "copyright page",
 							 "dedication", "contents", "table of contents", "maps", "glossary",
 							 "about the author", "start"))
 WHITESPACE_PATTERN = re.compile("\\s+")
+DEFAULT_HTML_FEATURES = "html.parser"
+_TITLE_END_PATTERN = re.compile("</title\\s*>", re.IGNORECASE)
 
 _ChapterDescription = namedtuple("_ChapterDescription", "seq name src")
 
 
 class EPUBChapterReader(object):
 
+	def __init__(self, features: str = DEFAULT_HTML_FEATURES, strategy_cache: Optional[ChapterStructureCache] = None):
+		"""
+		:param features: The BeautifulSoup tree builder features to use for parsing the content documents, e.g. "lxml".
+		:param strategy_cache: If not None, a cache used for choosing how to parse chapters based on the document structure.
+		"""
+		self.features = features
+		self.strategy_cache = strategy_cache
+
 	@staticmethod
 	def __is_chapter_header(text: str) -> bool:
 		lower = text.lower()
@@ -78,14 +94,13 @@ class EPUBChapterReader(object):
 		chapter_name = " ".join(tokens[1:])
 		return chapter_seq, chapter_name
 
-	@classmethod
-	def __parse_doc(cls, doc: epub.EpubHtml) -> Iterator[Chapter]:
-		soup = bs4.BeautifulSoup(doc.get_content(), "html.parser")
-		return _parse_chapters(soup)
+	def __parse_doc(self, content: Union[bytes, BinaryIO]) -> Iterator[Chapter]:
+		soup = bs4.BeautifulSoup(content, self.features)
+		return _parse_chapters(soup, self.strategy_cache)
 
 	@classmethod
-	def __parse_navigation(cls, elem: ebooklib.epub.EpubNcx) -> List[_ChapterDescription]:
-		soup = bs4.BeautifulSoup(elem.get_content(), "xml")
+	def __parse_navigation(cls, content: Union[bytes, BinaryIO]) -> List[_ChapterDescription]:
+		soup = bs4.BeautifulSoup(content, "xml")
 		nav_points = soup.find_all("navPoint")
 		# There are occasionally duplicate navigation points used as "subtitles"
 		nav_points_by_src = defaultdict(list)
@@ -106,28 +121,55 @@ class EPUBChapterReader(object):
 
 		return result
 
-	@classmethod
-	def __read_file(cls, infile_path: str) -> Tuple[str, List[Chapter]]:
-		book = ebooklib.epub.read_epub(infile_path)
-		book_title = normalize_spacing(book.title)
+	def __parse_docs(self, book_title: str, chapter_descs: Iterable[_ChapterDescription],
+					 open_doc: Callable[[str], Union[bytes, BinaryIO]]) -> Tuple[str, List[Chapter]]:
+		book_title = normalize_spacing(book_title)
 		logging.debug("Parsing data for book titled \"%s\".", book_title)
-		ordered_chapter_descs = sorted((
-			desc for elem in book.get_items_of_type(ebooklib.ITEM_NAVIGATION) for desc in cls.__parse_navigation(elem)),
-			key=lambda desc: chapter_seq_sort_key(desc.seq))
+		ordered_chapter_descs = sorted(chapter_descs, key=lambda desc: chapter_seq_sort_key(desc.seq))
 		if not ordered_chapter_descs:
 			raise ValueError("No navigation elements found!")
 
 		chapters = []
 		for desc in ordered_chapter_descs:
-			doc = book.get_item_with_href(desc.src)
 			logging.debug("Parsing document with HREF \"%s\".", desc.src)
-			chapters.extend(cls.__parse_doc(doc))
+			chapters.extend(self.__parse_doc(open_doc(desc.src)))
 		logging.debug("Parsed %d chapter(s) for book titled \"%s\".", len(chapters), book_title)
 		return book_title, chapters
 
-	def __call__(self, infile_path) -> Tuple[str, List[Chapter]]:
+	def __read_archive(self, archive_file: Union[str, BinaryIO]) -> Tuple[str, List[Chapter]]:
+		with EPUBArchive(archive_file) as archive:
+			with archive.open_navigation() as inf:
+				chapter_descs = self.__parse_navigation(inf)
+
+			def open_doc(href: str) -> bytes:
+				with archive.open_document(href) as doc_inf:
+					return doc_inf.read()
+
+			return self.__parse_docs(archive.title, chapter_descs, open_doc)
+
+	def __read_ebooklib_book(self, infile_path: str) -> Tuple[str, List[Chapter]]:
+		book = ebooklib.epub.read_epub(infile_path)
+		chapter_descs = (desc for elem in book.get_items_of_type(ebooklib.ITEM_NAVIGATION) for desc in
+						 self.__parse_navigation(elem.get_content()))
+		return self.__parse_docs(book.title, chapter_descs, lambda href: book.get_item_with_href(href).get_content())
+
+	def __read_file(self, infile_path: str, content: Optional[bytes]) -> Tuple[str, List[Chapter]]:
+		# Only decompress the navigation and the documents it references, using ebooklib only if that fails
+		try:
+			result = self.__read_archive(infile_path if content is None else io.BytesIO(content))
+		except (MalformedEPUBError, zipfile.BadZipFile) as e:
+			logging.warning("Could not read \"%s\" directly (%s); Falling back to ebooklib.", infile_path, e)
+			result = self.__read_ebooklib_book(infile_path)
+		return result
+
+	def __call__(self, infile_path: str, content: Optional[bytes] = None) -> Tuple[str, List[Chapter]]:
+		"""
+		:param infile_path: The path of the EPUB file to read.
+		:param content: The content of the file if it has already been read into memory.
+		:return: The book title and its chapters.
+		"""
 		logging.info("Reading \"%s\".", infile_path)
-		book_title, chapters = self.__read_file(infile_path)
+		book_title, chapters = self.__read_file(infile_path, content)
 		merged_chapters = []
 		_merge_file_chapters(chapters, merged_chapters)
 		return book_title, merged_chapters
@@ -135,6 +177,14 @@ class EPUBChapterReader(object):
 
 class HTMLChapterReader(object):
 
+	def __init__(self, features: str = DEFAULT_HTML_FEATURES, strategy_cache: Optional[ChapterStructureCache] = None):
+		"""
+		:param features: The BeautifulSoup tree builder features to use for parsing, e.g. "lxml".
+		:param strategy_cache: If not None, a cache used for choosing how to parse chapters based on the document structure.
+		"""
+		self.features = features
+		self.strategy_cache = strategy_cache
+
 	@staticmethod
 	def __merge_file_chapters(file_data: Mapping[str, Sequence[Chapter]]) -> List[Chapter]:
 		result = []
@@ -145,20 +195,64 @@ class HTMLChapterReader(object):
 
 		return result
 
-	@classmethod
-	def __read_file(cls, infile_path: str) -> Tuple[str, Tuple[Chapter, ...]]:
+	@staticmethod
+	def read_book_title(infile_path: str, chunk_size: int = 4096) -> str:
+		"""
+		Reads only the title of the book a given HTML file belongs to, reading the file only up to the end of its title
+		element.
+
+		:param infile_path: The path of the HTML file to read.
+		:param chunk_size: The number of characters to read at a time while looking for the end of the title.
+		:return: The book title.
+		"""
+		chunks = []
 		with open(infile_path) as inf:
-			soup = bs4.BeautifulSoup(inf, "html.parser")
-			book_title = normalize_spacing(soup.head.title.text)
-			logging.debug("Parsing data for book titled \"%s\".", book_title)
-			chapters = tuple(_parse_chapters(soup))
-			return book_title, chapters
+			for chunk in iter(lambda: inf.read(chunk_size), ""):
+				chunks.append(chunk)
+				# Also search the end of the previous chunk in case the end tag is split between the two
+				if _TITLE_END_PATTERN.search("".join(chunks[-2:])):
+					break
+		soup = bs4.BeautifulSoup("".join(chunks), "html.parser", parse_only=bs4.SoupStrainer("title"))
+		return normalize_spacing(soup.title.text)
+
+	def __parse_file(self, content: Union[str, IO[str]]) -> Tuple[str, Tuple[Chapter, ...]]:
+		soup = bs4.BeautifulSoup(content, self.features)
+		book_title = normalize_spacing(soup.head.title.text)
+		logging.debug("Parsing data for book titled \"%s\".", book_title)
+		chapters = tuple(_parse_chapters(soup, self.strategy_cache))
+		return book_title, chapters
 
-	def __call__(self, infile_paths: Iterable[str]) -> Iterator[Tuple[str, List[Chapter]]]:
-		book_file_data = defaultdict(dict)  # type: DefaultDict[str, Dict[str, Tuple[Chapter, ...]]]
+	def __read_file(self, infile_path: str) -> Tuple[str, Tuple[Chapter, ...]]:
+		with open(infile_path) as inf:
+			return self.__parse_file(inf)
+
+	def __parse_files(self, infile_contents: Iterable[Tuple[str, str]]) -> Iterator[
+		Tuple[str, str, Tuple[Chapter, ...]]]:
+		for infile_path, content in infile_contents:
+			logging.info("Parsing \"%s\".", infile_path)
+			book_title, chapters = self.__parse_file(content)
+			yield infile_path, book_title, chapters
+
+	def __read_files(self, infile_paths: Iterable[str]) -> Iterator[Tuple[str, str, Tuple[Chapter, ...]]]:
 		for infile_path in infile_paths:
 			logging.info("Reading \"%s\".", infile_path)
 			book_title, chapters = self.__read_file(infile_path)
+			yield infile_path, book_title, chapters
+
+	def __call__(self, infile_paths: Iterable[str]) -> Iterator[Tuple[str, List[Chapter]]]:
+		return self.__merge_books(self.__read_files(infile_paths))
+
+	def read_contents(self, infile_contents: Iterable[Tuple[str, str]]) -> Iterator[Tuple[str, List[Chapter]]]:
+		"""
+		:param infile_contents: Pairs of the path of each HTML file and its content, which has already been read into memory.
+		:return: Pairs of each book title and its chapters.
+		"""
+		return self.__merge_books(self.__parse_files(infile_contents))
+
+	def __merge_books(self, file_chapters: Iterable[Tuple[str, str, Tuple[Chapter, ...]]]) -> Iterator[
+		Tuple[str, List[Chapter]]]:
+		book_file_data = defaultdict(dict)  # type: DefaultDict[str, Dict[str, Tuple[Chapter, ...]]]
+		for infile_path, book_title, chapters in file_chapters:
 			if chapters:
 				book_file_data[book_title][infile_path] = chapters
 		logging.info("Read data for %d book(s): %s", len(book_file_data), sorted(book_file_data.keys()))
@@ -184,6 +278,25 @@ def normalize_spacing(text: str) -> str:
 	return " ".join(tokens)
 
 
+def read_chapters(lines: Iterable[str]) -> Iterator[Chapter]:
+	"""
+	Reads chapters in the format written by :func:`write_chapters`.
+
+	:param lines: The lines of text to read.
+	:return: The chapters read, in the order they were written.
+	"""
+	chapter_lines = []
+	for line in lines:
+		line = line.strip()
+		if line == CHAPTER_DELIM:
+			yield __parse_written_chapter(chapter_lines)
+			chapter_lines = []
+		elif line:
+			chapter_lines.append(line)
+	if chapter_lines:
+		yield __parse_written_chapter(chapter_lines)
+
+
 def write_chapters(chapters: Iterable[Chapter], out: IO[str]):
 	chapters = iter(chapters)
 	__write_chapter(next(chapters), out)
@@ -193,14 +306,43 @@ def write_chapters(chapters: Iterable[Chapter], out: IO[str]):
 		__write_chapter(chapter, out)
 
 
-def _parse_chapters(soup: bs4.BeautifulSoup) -> Tuple[Chapter, ...]:
+def _parse_chapters(soup: bs4.BeautifulSoup, strategy_cache: Optional[ChapterStructureCache] = None) -> Tuple[
+	Chapter, ...]:
+	if strategy_cache is None:
+		fingerprint = None
+		cached_strategy = None
+	else:
+		fingerprint = fingerprint_structure(soup)
+		cached_strategy = strategy_cache.lookup(fingerprint)
+
 	# Try parsing structured text first
-	result = tuple(_parse_structured_chapters(soup))
-	if not result:
-		result = tuple(_parse_unstructured_chapters(soup))
+	result = ()
+	successful_strategy = None
+	skipped_strategies = []
+	for name, parse, cannot_succeed in _CHAPTER_PARSING_STRATEGIES:
+		if cached_strategy not in (None, name) and cannot_succeed is not None and cannot_succeed(soup):
+			# Only skip a strategy which is certain to fail so that the cache never changes the result
+			skipped_strategies.append(name)
+		else:
+			start = time.perf_counter()
+			result = tuple(parse(soup))
+			if result:
+				successful_strategy = name
+				break
+			elif strategy_cache is not None:
+				strategy_cache.record_failure(name, time.perf_counter() - start)
+	if strategy_cache is not None:
+		if successful_strategy is not None and successful_strategy == cached_strategy:
+			strategy_cache.record_hit(skipped_strategies)
+		else:
+			strategy_cache.record_miss(fingerprint, successful_strategy, stale=cached_strategy is not None)
 	return result
 
 
+def _has_no_chapter_headers(soup: bs4.BeautifulSoup) -> bool:
+	return soup.find("h2") is None
+
+
 def _parse_structured_chapters(soup: bs4.BeautifulSoup) -> Iterator[Chapter]:
 	chapter_headers = tuple(soup.find_all("h2"))
 	if chapter_headers:
@@ -302,6 +444,11 @@ def _parse_unstructured_chapters(soup: bs4.BeautifulSoup) -> Iterator[Chapter]:
 	return (chapter for chapter in chapters if chapter)
 
 
+# The name of each strategy, the function for parsing chapters with it and, if any, a cheap check that it cannot succeed
+_CHAPTER_PARSING_STRATEGIES = (("structured", _parse_structured_chapters, _has_no_chapter_headers),
+							   ("unstructured", _parse_unstructured_chapters, None))
+
+
 def _is_book_end(par_text: str, following_ctx: Iterator[bs4.Tag]):
 	single_end_match = SINGLE_BOOK_END_PATTERN.match(par_text)
 	if single_end_match:
@@ -369,6 +516,19 @@ def __is_toc_header(text: str) -> bool:
 	return result
 
 
+def __parse_written_chapter(lines: Sequence[str]) -> Chapter:
+	if not lines:
+		raise ValueError("Chapter has no title.")
+	seq_desc, _, title = lines[0].partition(_CHAPTER_TITLE_DELIM)
+	chapter_header_match = CHAPTER_HEADER_PATTERN.match(seq_desc)
+	if chapter_header_match and chapter_header_match.group(1):
+		seq = chapter_header_match.group(1)
+	else:
+		# e.g. "prologue" and "epilogue"
+		seq = seq_desc.lower()
+	return Chapter(seq, title, list(lines[1:]))
+
+
 def __parse_title(par_following_ctxs: Iterator[Tuple[bs4.Tag, Iterator[bs4.Tag]]]) -> str:
 	# The following paragraph should be the chapter title
 	title_par, following_ctx = next(par_following_ctxs)
@@ -384,7 +544,7 @@ def __parse_title(par_following_ctxs: Iterator[Tuple[bs4.Tag, Iterator[bs4.Tag]]
 
 def __write_chapter(chapter: Chapter, out: IO[str]):
 	seq_desc = __create_seq_desc(chapter.seq)
-	chapter_title = seq_desc + ": " + chapter.title
+	chapter_title = seq_desc + _CHAPTER_TITLE_DELIM + chapter.title
 	print(chapter_title, file=out)
 	print("\n", file=out)
 	for par in chapter.pars:
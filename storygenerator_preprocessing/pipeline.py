@@ -0,0 +1,247 @@
+"""
+Functionalities for overlapping the reading of input and the writing of output with processing in the main thread.
+"""
+
+__author__ = "Todd Shore <errantlinguist+github@gmail.com>"
+__copyright__ = "Copyright (C) 2018 Todd Shore"
+__license__ = "Apache License, Version 2.0"
+
+import queue
+import threading
+import time
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+U = TypeVar("U")
+
+_END = object()
+
+
+class QueueMetrics(object):
+	"""
+	Statistics about how full a queue between two pipeline stages was and how long each stage was blocked on it.
+	"""
+
+	def __init__(self, name: str, maxsize: int):
+		self.name = name
+		self.maxsize = maxsize
+		self.put_count = 0
+		self.depth_sum = 0
+		self.max_depth = 0
+		self.put_wait_secs = 0.0
+		self.get_wait_secs = 0.0
+
+	@property
+	def mean_depth(self) -> float:
+		return self.depth_sum / self.put_count if self.put_count > 0 else 0.0
+
+	def __repr__(self):
+		fields = ("{name=", self.name, ", maxsize=", str(self.maxsize), ", put_count=", str(self.put_count),
+				  ", mean_depth=", "{:.2f}".format(self.mean_depth), ", max_depth=", str(self.max_depth),
+				  ", put_wait_secs=", "{:.3f}".format(self.put_wait_secs), ", get_wait_secs=",
+				  "{:.3f}".format(self.get_wait_secs), "}")
+		field_repr = "".join(fields)
+		return self.__class__.__name__ + field_repr
+
+
+class MonitoredQueue(object):
+	"""
+	A bounded queue which records its depth after each item is put in it and the time spent blocking on it.
+	"""
+
+	def __init__(self, name: str, maxsize: int):
+		if maxsize < 1:
+			raise ValueError("Queue \"{}\" must have a positive size but was {}.".format(name, maxsize))
+		self.__queue = queue.Queue(maxsize)
+		self.metrics = QueueMetrics(name, maxsize)
+
+	def get(self) -> Any:
+		start = time.perf_counter()
+		result = self.__queue.get()
+		self.metrics.get_wait_secs += time.perf_counter() - start
+		return result
+
+	def put_end(self):
+		"""
+		Puts the marker for the end of the items in the queue without recording it in the metrics.
+		"""
+		self.__queue.put(_END)
+
+	def put(self, item: Any):
+		start = time.perf_counter()
+		self.__queue.put(item)
+		metrics = self.metrics
+		metrics.put_wait_secs += time.perf_counter() - start
+		depth = self.__queue.qsize()
+		metrics.put_count += 1
+		metrics.depth_sum += depth
+		metrics.max_depth = max(metrics.max_depth, depth)
+
+
+class _Failure(object):
+
+	def __init__(self, exception: Exception):
+		self.exception = exception
+
+
+class Prefetcher(object):
+	"""
+	Loads items in a background thread so that the next items are already loaded when the current one has been processed.
+	Loading blocks once the given number of loaded items or, optionally, of bytes is waiting to be consumed.
+	"""
+
+	def __init__(self, items: Iterable[T], load: Callable[[T], U], maxsize: int = 2, max_bytes: Optional[int] = None,
+				 size: Optional[Callable[[T], int]] = None):
+		"""
+		:param items: The items to load, e.g. file paths.
+		:param load: The function used to load each item, e.g. reading a file.
+		:param maxsize: The maximum number of loaded items to hold in memory while waiting for them to be consumed.
+		:param max_bytes: If not None, the maximum number of bytes of loaded items to hold in memory while waiting for them to be consumed; A larger item is only loaded once no other item is waiting.
+		:param size: The function used to get the number of bytes an item will take up once loaded, e.g. the size of the file it is read from; Required if a byte limit is given.
+		"""
+		if max_bytes is not None and size is None:
+			raise ValueError("A size function is required for limiting the number of bytes prefetched.")
+		self.__queue = MonitoredQueue("prefetch", maxsize)
+		self.__max_bytes = max_bytes
+		self.__size = size
+		self.__waiting_bytes = 0
+		self.__space = threading.Condition()
+		self.__exhausted = False
+		self.__stopped = threading.Event()
+		self.__thread = threading.Thread(target=self.__run, args=(iter(items), load), name="prefetcher", daemon=True)
+		self.__thread.start()
+
+	def __enter__(self) -> "Prefetcher":
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.close()
+
+	def __iter__(self) -> Iterator[Tuple[T, U]]:
+		"""
+		:return: Pairs of each item and its loaded form, in the order of the given items.
+		"""
+		while True:
+			entry = self.__queue.get()
+			if entry is _END:
+				self.__exhausted = True
+				break
+			elif isinstance(entry, _Failure):
+				raise entry.exception
+			else:
+				item, loaded, item_size = entry
+				if item_size > 0:
+					with self.__space:
+						self.__waiting_bytes -= item_size
+						self.__space.notify()
+				yield item, loaded
+
+	@property
+	def metrics(self) -> QueueMetrics:
+		return self.__queue.metrics
+
+	def close(self):
+		"""
+		Stops loading any further items, discarding any which have already been loaded but not consumed.
+		"""
+		self.__stopped.set()
+		with self.__space:
+			self.__space.notify()
+		# Unblock the loading thread if it is waiting for space in the queue; It always finishes by putting the end marker
+		while not self.__exhausted:
+			self.__exhausted = self.__queue.get() is _END
+
+	def __reserve(self, item: T) -> int:
+		"""
+		Waits until there is space for the given item within the byte limit.
+
+		:param item: The item to be loaded.
+		:return: The number of bytes reserved for the item.
+		"""
+		result = self.__size(item)
+		with self.__space:
+			self.__space.wait_for(lambda: self.__stopped.is_set() or self.__waiting_bytes == 0 or
+										  self.__waiting_bytes + result <= self.__max_bytes)
+			self.__waiting_bytes += result
+		return result
+
+	def __run(self, items: Iterator[T], load: Callable[[T], U]):
+		try:
+			for item in items:
+				item_size = 0 if self.__max_bytes is None else self.__reserve(item)
+				if self.__stopped.is_set():
+					break
+				self.__queue.put((item, load(item), item_size))
+		except Exception as e:
+			self.__queue.put(_Failure(e))
+		self.__queue.put_end()
+
+
+class BackgroundWriter(object):
+	"""
+	Stores output in a background thread so that processing can continue while the output is written. Submitting blocks
+	once the given number of outputs is waiting to be stored.
+	"""
+
+	def __init__(self, store: Callable[..., None], maxsize: int = 2):
+		"""
+		:param store: The function used to store each output, e.g. writing it to a file.
+		:param maxsize: The maximum number of outputs to hold in memory while waiting for them to be stored.
+		"""
+		self.__store = store
+		self.__queue = MonitoredQueue("write", maxsize)
+		self.__error = None
+		self.__thread = threading.Thread(target=self.__run, name="writer", daemon=True)
+		self.__thread.start()
+
+	def __enter__(self) -> "BackgroundWriter":
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		if exc_type is None:
+			self.close()
+		else:
+			# Don't mask the original exception with any raised while storing
+			self.__close()
+
+	@property
+	def metrics(self) -> QueueMetrics:
+		return self.__queue.metrics
+
+	def close(self):
+		"""
+		Waits for all submitted outputs to be stored.
+
+		:raises Exception: If storing any output failed.
+		"""
+		self.__close()
+		self.__raise_error()
+
+	def submit(self, *args):
+		"""
+		:param args: The arguments to call the store function with.
+		:raises Exception: If storing any previously-submitted output failed.
+		"""
+		self.__raise_error()
+		self.__queue.put(args)
+
+	def __close(self):
+		if self.__thread.is_alive():
+			self.__queue.put_end()
+			self.__thread.join()
+
+	def __raise_error(self):
+		if self.__error is not None:
+			raise self.__error
+
+	def __run(self):
+		while True:
+			args = self.__queue.get()
+			if args is _END:
+				break
+			elif self.__error is None:
+				try:
+					self.__store(*args)
+				except Exception as e:
+					# Keep consuming so that the submitting thread doesn't block forever
+					self.__error = e
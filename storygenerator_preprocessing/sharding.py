@@ -0,0 +1,127 @@
+"""
+Functionalities for splitting work across multiple machines which share a file system and for merging the results.
+"""
+
+__author__ = "Todd Shore <errantlinguist+github@gmail.com>"
+__copyright__ = "Copyright (C) 2018 Todd Shore"
+__license__ = "Apache License, Version 2.0"
+
+import hashlib
+import json
+import os
+import re
+from collections import defaultdict, namedtuple
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Sequence, TypeVar
+
+from . import atomic_write, natural_keys
+
+MANIFEST_FILENAME_PATTERN = re.compile("shard-(\\d+)-of-(\\d+)\\.json")
+SHARD_SPEC_PATTERN = re.compile("(\\d+)/(\\d+)")
+
+T = TypeVar("T")
+
+ShardSpec = namedtuple("ShardSpec", "index count")
+
+
+def create_manifest_path(outdir: str, spec: ShardSpec) -> str:
+	return os.path.join(outdir, "shard-{}-of-{}.json".format(spec.index, spec.count))
+
+
+def describe_file(path: str) -> Dict[str, Any]:
+	"""
+	:param path: The path of the file to describe.
+	:return: The size and SHA-256 digest of the file, for checking that it has not changed.
+	"""
+	return {"size": os.path.getsize(path), "sha256": file_sha256(path)}
+
+
+def file_matches(path: str, desc: Mapping[str, Any]) -> bool:
+	"""
+	:param path: The path of the file to check.
+	:param desc: The description of the file created by :func:`describe_file`.
+	:return: True iff the file exists and its size and SHA-256 digest are those described.
+	"""
+	return os.path.isfile(path) and os.path.getsize(path) == desc["size"] and file_sha256(path) == desc["sha256"]
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+	result = hashlib.sha256()
+	with open(path, 'rb') as inf:
+		for chunk in iter(lambda: inf.read(chunk_size), b""):
+			result.update(chunk)
+	return result.hexdigest()
+
+
+def parse_shard_spec(text: str) -> ShardSpec:
+	"""
+	:param text: A shard description of the form "i/N", with the shard index i counted from zero, e.g. "0/4" for the first of four shards.
+	:return: The parsed shard description.
+	"""
+	match = SHARD_SPEC_PATTERN.fullmatch(text.strip())
+	if not match:
+		raise ValueError("Shard must be of the form \"i/N\" but was \"{}\".".format(text))
+	result = ShardSpec(int(match.group(1)), int(match.group(2)))
+	if not 0 <= result.index < result.count:
+		raise ValueError("Shard index must be at least 0 and less than {} but was {}.".format(result.count, result.index))
+	return result
+
+
+def read_manifest(path: str) -> Dict[str, Any]:
+	with open(path, 'r') as inf:
+		return json.load(inf)
+
+
+def select_shard(items: Sequence[T], spec: ShardSpec) -> List[T]:
+	"""
+	Deterministically selects every N-th item starting from the shard index, so that items with similar sort keys are
+	spread across shards.
+
+	:param items: The items to partition, which must be in the same order on every machine, e.g. sorted by :func:`natural_keys`.
+	:param spec: The shard to select.
+	:return: The items belonging to the given shard.
+	"""
+	return list(items[spec.index::spec.count])
+
+
+def select_shard_by_key(items: Iterable[str], key: Callable[[str], str], spec: ShardSpec) -> List[str]:
+	"""
+	Partitions items so that all items with the same key belong to the same shard, e.g. all files for the same book.
+
+	:param items: The items to partition, e.g. file paths.
+	:param key: The function for getting the key of each item, e.g. a book title.
+	:param spec: The shard to select.
+	:return: The items belonging to the given shard, sorted by :func:`natural_keys`.
+	"""
+	items_by_key = defaultdict(list)
+	for item in items:
+		items_by_key[key(item)].append(item)
+	shard_keys = select_shard(sorted(items_by_key.keys(), key=natural_keys), spec)
+	return sorted((item for shard_key in shard_keys for item in items_by_key[shard_key]), key=natural_keys)
+
+
+def write_manifest(outdir: str, spec: ShardSpec, infiles: Iterable[str], outfile_inputs: Mapping[str, Iterable[str]],
+				   failures_path: Optional[str] = None) -> str:
+	"""
+	Writes a description of the work done for a shard so that the results of all shards can be merged and verified.
+
+	:param outdir: The directory the shard output was written to.
+	:param spec: The shard which was processed.
+	:param infiles: The input files read for the shard.
+	:param outfile_inputs: The output files written for the shard, each mapped to the input files it was created from.
+	:param failures_path: The report of the inputs which could not be processed, if any was written.
+	:return: The path of the manifest written.
+	"""
+	manifest = {
+		"index": spec.index,
+		"count": spec.count,
+		"inputs": sorted(infiles, key=natural_keys),
+		"outputs": {os.path.basename(path): dict(describe_file(path), inputs=sorted(outfile_inputs[path], key=natural_keys))
+					for path in sorted(outfile_inputs.keys(), key=natural_keys)}
+	}
+	if failures_path is not None:
+		manifest["failures"] = dict(describe_file(failures_path), path=os.path.relpath(failures_path, outdir))
+	result = create_manifest_path(outdir, spec)
+	# Never leave a partially-written manifest which could be mistaken for a finished shard
+	with atomic_write(result) as outf:
+		json.dump(manifest, outf, indent=2, sort_keys=True)
+	return result
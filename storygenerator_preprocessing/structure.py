@@ -0,0 +1,171 @@
+"""
+Functionalities for remembering which chapter-parsing strategy works for documents created using the same markup
+template, e.g. books from the same publisher.
+"""
+
+__author__ = "Todd Shore <errantlinguist+github@gmail.com>"
+__copyright__ = "Copyright (C) 2018 Todd Shore"
+__license__ = "Apache License, Version 2.0"
+
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+import bs4
+
+from . import atomic_write
+
+CACHE_VERSION = 1
+DEFAULT_FINGERPRINT_TAG_LIMIT = 256
+
+T = TypeVar("T")
+
+
+class ChapterStructureCache(object):
+	"""
+	A mapping of document structure fingerprints to the name of the chapter-parsing strategy which succeeded for
+	documents with that fingerprint, together with statistics about how useful the cache has been.
+	"""
+
+	def __init__(self, strategies: Optional[Dict[str, str]] = None,
+				 failed_attempt_secs: Optional[Dict[str, List[float]]] = None):
+		"""
+		:param strategies: The name of the successful strategy for each fingerprint.
+		:param failed_attempt_secs: The total number of seconds spent on and the number of failed attempts at parsing using each strategy, used for estimating the time saved by skipping a strategy.
+		"""
+		self.strategies = {} if strategies is None else strategies
+		self.failed_attempt_secs = {} if failed_attempt_secs is None else failed_attempt_secs
+		# What has been learned since this cache was created, for merging it into another cache
+		self.learned_strategies = {}  # type: Dict[str, str]
+		self.learned_failed_attempt_secs = {}  # type: Dict[str, List[float]]
+		self.hits = 0
+		self.misses = 0
+		self.stale_hits = 0
+		self.saved_secs = 0.0
+
+	def __len__(self) -> int:
+		return len(self.strategies)
+
+	def copy(self) -> "ChapterStructureCache":
+		"""
+		:return: A copy of the cached strategies and attempt timings with its own statistics, e.g. for use in a worker process, which can later be merged back into this cache using :meth:`merge`.
+		"""
+		return ChapterStructureCache(dict(self.strategies),
+									 {strategy: list(totals) for strategy, totals in self.failed_attempt_secs.items()})
+
+	def lookup(self, fingerprint: str) -> Optional[str]:
+		return self.strategies.get(fingerprint)
+
+	def merge(self, other: "ChapterStructureCache"):
+		"""
+		Adds what another cache has learned since it was created and its statistics to this one.
+
+		:param other: The cache to merge into this one, e.g. a copy used in a worker process.
+		"""
+		self.strategies.update(other.learned_strategies)
+		self.learned_strategies.update(other.learned_strategies)
+		for strategy, (secs, count) in other.learned_failed_attempt_secs.items():
+			self.__add_failures(strategy, secs, count)
+		self.hits += other.hits
+		self.misses += other.misses
+		self.stale_hits += other.stale_hits
+		self.saved_secs += other.saved_secs
+
+	def record_failure(self, strategy: str, secs: float):
+		"""
+		:param strategy: The name of the strategy which found no chapters.
+		:param secs: The number of seconds wasted on the attempt.
+		"""
+		self.__add_failures(strategy, secs, 1)
+
+	def record_hit(self, skipped_strategies: List[str]):
+		"""
+		:param skipped_strategies: The names of the strategies which would have been tried first without the cache.
+		"""
+		self.hits += 1
+		self.saved_secs += sum(self.mean_failed_attempt_secs(strategy) for strategy in skipped_strategies)
+
+	def record_miss(self, fingerprint: str, strategy: Optional[str], stale: bool = False):
+		"""
+		:param fingerprint: The fingerprint of the document which was parsed without the help of the cache.
+		:param strategy: The name of the strategy which succeeded or None if none did, e.g. for front matter, in which case the cache is not changed.
+		:param stale: True iff the strategy previously cached for the fingerprint failed.
+		"""
+		self.misses += 1
+		if stale:
+			self.stale_hits += 1
+		if strategy is not None:
+			self.strategies[fingerprint] = strategy
+			self.learned_strategies[fingerprint] = strategy
+
+	def __add_failures(self, strategy: str, secs: float, count: int):
+		for failed_attempt_secs in (self.failed_attempt_secs, self.learned_failed_attempt_secs):
+			totals = failed_attempt_secs.setdefault(strategy, [0.0, 0])
+			totals[0] += secs
+			totals[1] += count
+
+	def mean_failed_attempt_secs(self, strategy: str) -> float:
+		total_secs, count = self.failed_attempt_secs.get(strategy, (0.0, 0))
+		return total_secs / count if count > 0 else 0.0
+
+	def log_stats(self):
+		lookups = self.hits + self.misses
+		hit_rate = self.hits / lookups if lookups > 0 else 0.0
+		logging.info(
+			"Chapter structure cache: %d hit(s) and %d miss(es) (hit rate %.1f%%), %d of which due to stale entries; Estimated %.3f second(s) saved; %d fingerprint(s) cached.",
+			self.hits, self.misses, hit_rate * 100, self.stale_hits, self.saved_secs, len(self))
+
+	@classmethod
+	def load_or_create(cls, path: str) -> "ChapterStructureCache":
+		"""
+		:param path: The path of the cache file.
+		:return: The cache read from the given file if it exists or otherwise a new, empty cache.
+		"""
+		return cls.load(path) if os.path.exists(path) else cls()
+
+	@classmethod
+	def load(cls, path: str) -> "ChapterStructureCache":
+		with open(path, 'r') as inf:
+			data = json.load(inf)
+		if data.get("version") != CACHE_VERSION:
+			raise ValueError("Unsupported chapter structure cache version: {}".format(data.get("version")))
+		return cls(data["strategies"], data["failed_attempt_secs"])
+
+	def save(self, path: str):
+		data = {"version": CACHE_VERSION, "strategies": self.strategies, "failed_attempt_secs": self.failed_attempt_secs}
+		with atomic_write(path) as outf:
+			json.dump(data, outf, indent=2, sort_keys=True)
+
+
+def fingerprint_structure(soup: bs4.BeautifulSoup, tag_limit: int = DEFAULT_FINGERPRINT_TAG_LIMIT) -> str:
+	"""
+	Creates a fingerprint of the markup template used for a document from the tags and classes used at its start,
+	which are usually the same for all books from the same publisher while being independent of the book content.
+
+	:param soup: The document to fingerprint.
+	:param tag_limit: The number of tags at the start of the document to use.
+	:return: A hexadecimal digest of the distinct tag names and classes used.
+	"""
+	signatures = set()
+	for tag in soup.find_all(True, limit=tag_limit):
+		classes = tag.get("class") or ()
+		if isinstance(classes, str):
+			# XML tree builders don't split multi-valued attributes
+			classes = classes.split()
+		signatures.add(tag.name + "." + ".".join(sorted(classes)))
+	return hashlib.sha1("\n".join(sorted(signatures)).encode("utf-8")).hexdigest()
+
+
+def merge_worker_caches(results: Iterable[Tuple[T, Optional[ChapterStructureCache]]],
+						strategy_cache: Optional[ChapterStructureCache]) -> Iterator[T]:
+	"""
+	:param results: Pairs of each result returned by a worker process and the copy of the cache it used, if any.
+	:param strategy_cache: The cache to merge what each worker learned into.
+	:return: The results without the caches.
+	"""
+	for result, worker_strategy_cache in results:
+		if worker_strategy_cache is not None:
+			strategy_cache.merge(worker_strategy_cache)
+		yield result
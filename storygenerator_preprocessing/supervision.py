@@ -0,0 +1,214 @@
+"""
+Functionalities for running tasks in supervised worker processes so that a task which hangs, crashes or uses too much
+memory cannot bring down the entire run.
+"""
+
+__author__ = "Todd Shore <errantlinguist+github@gmail.com>"
+__copyright__ = "Copyright (C) 2018 Todd Shore"
+__license__ = "Apache License, Version 2.0"
+
+import csv
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import time
+from collections import deque, namedtuple
+from typing import Any, Callable, Hashable, IO, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# Start workers from a clean server process rather than forking the supervising process, which may hold a lot of memory
+# and be running other threads
+_CONTEXT = multiprocessing.get_context(
+	"forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+_RESULT_STATUS = "result"
+_ERROR_STATUS = "error"
+
+# A function to call in the worker process together with the arguments to call it with
+Attempt = Tuple[Callable[..., Any], Tuple[Any, ...]]
+# The key of a task which failed in every attempt together with the reason for each failure
+TaskFailure = namedtuple("TaskFailure", "key reasons")
+
+
+class _RunningTask(object):
+
+	def __init__(self, key: Hashable, attempts: Sequence[Attempt], reasons: List[str],
+				 process: multiprocessing.process.BaseProcess, conn: multiprocessing.connection.Connection):
+		self.key = key
+		self.attempts = attempts
+		self.reasons = reasons
+		self.process = process
+		self.conn = conn
+		self.start_time = time.monotonic()
+
+
+class SupervisedExecutor(object):
+	"""
+	Runs each task in its own worker process, killing any which exceeds a wall-clock timeout or a ceiling on the memory
+	used by the worker itself, not counting memory shared with other processes. A failed task is retried using its next attempt, e.g. a more robust but slower parser; If every attempt
+	fails, it is recorded in :attr:`failures`. Multiple tasks are run concurrently, so a failing task does not hold up
+	the others.
+	"""
+
+	def __init__(self, jobs: int = 1, timeout: Optional[float] = None, max_rss: Optional[int] = None,
+				 poll_interval: float = 0.1):
+		"""
+		:param jobs: The maximum number of worker processes to run at once.
+		:param timeout: The maximum number of seconds each attempt may take or None for no limit.
+		:param max_rss: The maximum number of bytes of resident memory private to each worker it may use or None for no limit.
+		:param poll_interval: The maximum number of seconds to wait between checking the workers.
+		"""
+		if jobs < 1:
+			raise ValueError("Job count must be positive but was {}.".format(jobs))
+		if max_rss is not None and not os.path.isdir("/proc"):
+			logging.warning("Memory usage cannot be monitored on this platform; Ignoring RSS limit.")
+			max_rss = None
+		self.jobs = jobs
+		self.timeout = timeout
+		self.max_rss = max_rss
+		self.poll_interval = poll_interval
+		self.failures = []  # type: List[TaskFailure]
+
+	def __call__(self, tasks: Iterable[Tuple[Hashable, Sequence[Attempt]]]) -> Iterator[Tuple[Hashable, Any]]:
+		"""
+		:param tasks: Pairs of a key identifying each task and the attempts to make at completing it, in order.
+		:return: Pairs of the key of each successful task and its result, in the order the tasks were completed.
+		"""
+		pending = deque((key, attempts, []) for key, attempts in tasks)
+		running = []  # type: List[_RunningTask]
+		try:
+			while pending or running:
+				while pending and len(running) < self.jobs:
+					running.append(self.__start(*pending.popleft()))
+				if running:
+					multiprocessing.connection.wait(
+						[task.conn for task in running] + [task.process.sentinel for task in running],
+						timeout=self.poll_interval)
+
+				still_running = []
+				finished = []
+				for task in running:
+					outcome = self.__check(task)
+					if outcome is None:
+						still_running.append(task)
+					else:
+						finished.append((task, outcome))
+				running = still_running
+
+				for task, (status, value) in finished:
+					if status == _RESULT_STATUS:
+						yield task.key, value
+					else:
+						task.reasons.append(value)
+						if len(task.reasons) < len(task.attempts):
+							logging.warning("Attempt %d for \"%s\" failed (%s); Retrying.", len(task.reasons), task.key,
+											value)
+							pending.appendleft((task.key, task.attempts, task.reasons))
+						else:
+							logging.error("All attempts for \"%s\" failed (%s); Quarantining it.", task.key,
+										  "; ".join(task.reasons))
+							self.failures.append(TaskFailure(task.key, tuple(task.reasons)))
+		finally:
+			for task in running:
+				self.__kill(task)
+
+	def __check(self, task: _RunningTask) -> Optional[Tuple[str, Any]]:
+		if task.conn.poll():
+			try:
+				result = task.conn.recv()
+			except (EOFError, OSError):
+				# The worker died before it could send anything
+				task.process.join()
+				result = _ERROR_STATUS, "Worker exited with code {}.".format(task.process.exitcode)
+			else:
+				task.process.join()
+			task.conn.close()
+		elif not task.process.is_alive():
+			# e.g. a segmentation fault or being killed by the operating system
+			task.conn.close()
+			result = _ERROR_STATUS, "Worker exited with code {}.".format(task.process.exitcode)
+		else:
+			elapsed = time.monotonic() - task.start_time
+			if self.timeout is not None and elapsed > self.timeout:
+				self.__kill(task)
+				result = _ERROR_STATUS, "Timed out after {:.1f} second(s).".format(elapsed)
+			elif self.max_rss is not None:
+				rss = _read_private_rss(task.process.pid)
+				if rss is not None and rss > self.max_rss:
+					self.__kill(task)
+					result = _ERROR_STATUS, "Private resident memory of {} byte(s) exceeded limit of {}.".format(rss,
+																												 self.max_rss)
+				else:
+					result = None
+			else:
+				result = None
+		return result
+
+	@staticmethod
+	def __kill(task: _RunningTask):
+		task.process.kill()
+		task.process.join()
+		task.conn.close()
+
+	@staticmethod
+	def __start(key: Hashable, attempts: Sequence[Attempt], reasons: List[str]) -> _RunningTask:
+		func, args = attempts[len(reasons)]
+		parent_conn, child_conn = _CONTEXT.Pipe(duplex=False)
+		process = _CONTEXT.Process(target=_run_worker, args=(child_conn, func, args), daemon=True)
+		process.start()
+		# Close the parent's copy of the child's end so that a dying worker is seen as the end of the pipe
+		child_conn.close()
+		return _RunningTask(key, attempts, reasons, process, parent_conn)
+
+
+def write_failures(failures: Iterable[TaskFailure], out: IO[str], key_desc: Callable[[Hashable], str] = str):
+	"""
+	:param failures: The failures to write.
+	:param out: The stream to write the tab-separated failure report to.
+	:param key_desc: The function for describing each failed task using its key, e.g. listing the files it read.
+	"""
+	writer = csv.writer(out, dialect=csv.excel_tab)
+	writer.writerow(("TASK", "ATTEMPT", "REASON"))
+	for failure in failures:
+		desc = key_desc(failure.key)
+		for attempt, reason in enumerate(failure.reasons, start=1):
+			writer.writerow((desc, attempt, reason))
+
+
+def _read_private_rss(pid: int) -> Optional[int]:
+	"""
+	:param pid: The ID of the process to measure.
+	:return: The number of bytes of resident memory used only by the given process, excluding e.g. pages still shared with the process it was forked from, or None if it could not be read.
+	"""
+	try:
+		with open("/proc/{}/smaps_rollup".format(pid)) as inf:
+			return sum(int(line.split()[1]) * 1024 for line in inf if line.startswith("Private_"))
+	except FileNotFoundError:
+		# Linux before 4.14 has no summary of the memory mappings
+		return _read_rss(pid)
+	except (IndexError, OSError, ValueError):
+		# The process has probably just exited
+		return None
+
+
+def _read_rss(pid: int) -> Optional[int]:
+	try:
+		with open("/proc/{}/statm".format(pid)) as inf:
+			return int(inf.read().split()[1]) * _PAGE_SIZE
+	except (IndexError, OSError, ValueError):
+		# The process has probably just exited
+		return None
+
+
+def _run_worker(conn: multiprocessing.connection.Connection, func: Callable[..., Any], args: Tuple[Any, ...]):
+	try:
+		result = _RESULT_STATUS, func(*args)
+	except BaseException as e:
+		# Catch everything, e.g. "StopIteration" or "RecursionError" raised by a malformed document
+		result = _ERROR_STATUS, "{}: {}".format(type(e).__name__, e)
+	try:
+		conn.send(result)
+	except Exception as e:
+		conn.send((_ERROR_STATUS, "Could not send result: {}: {}".format(type(e).__name__, e)))
+	finally:
+		conn.close()
@@ -12,45 +12,227 @@ __license__ = "Apache License, Version 2.0"
 
 import argparse
 import csv
+import os
 import sys
-from typing import MutableMapping
+from typing import Dict, Iterable, Iterator, List, MutableMapping, Optional, Tuple
 
 import nltk
 
+from storygenerator_preprocessing.counts import MisraGriesCounter, NGramCounter, TokenCountStore, \
+	create_file_fingerprint, prune_counts
+
 
 def __create_argparser() -> argparse.ArgumentParser:
 	result = argparse.ArgumentParser(
 		description="Writes a lexicon to disk with the relevant counts of each word.")
-	result.add_argument("infiles", metavar="PATH", nargs="+",
+	result.add_argument("infiles", metavar="PATH", nargs="*",
 						help="The files to read.")
+	count_mode_args = result.add_mutually_exclusive_group()
+	count_mode_args.add_argument("-a", "--approximate", metavar="CAPACITY", type=int,
+								 help="Find candidate token types using at most twice this many counters and then count only the candidates exactly in a second pass; Any type occurring more than N / (CAPACITY + 1) times in N tokens is guaranteed to be counted.")
+	count_mode_args.add_argument("-s", "--store", metavar="PATH",
+								 help="A binary file to save the per-file counts to, keyed by absolute path; If it already exists, it is loaded first and only new or changed files are counted. The counts written are those of every file in the store, not only of the given PATHs.")
+	result.add_argument("--prune-missing", action="store_true",
+						help="Remove the counts for any file in the count store which no longer exists.")
+	result.add_argument("-m", "--merge", metavar="PATH", nargs="+", default=(),
+						help="Previously-saved count stores to merge with the counts before writing them.")
+	result.add_argument("-c", "--min-count", metavar="COUNT", type=int, default=1,
+						help="The minimum count a token type must have in order to be written.")
+	result.add_argument("-k", "--top-k", metavar="COUNT", type=int,
+						help="The maximum number of token types to write, keeping the most frequent ones.")
+	result.add_argument("-f", "--doc-freq", action="store_true",
+						help="Also write the number of files each token type occurs in.")
+	result.add_argument("-n", "--ngram-order", metavar="N", type=int, default=1,
+						help="Also count all n-grams up to this length in the same pass; Cannot be used together with a count store or approximate counting.")
+	result.add_argument("-p", "--ngram-outfile-prefix", metavar="PREFIX",
+						help="The path prefix of the files to write the n-gram counts of each order greater than one to, e.g. \"PREFIX.2grams.tsv\".")
 	return result
 
 
 def count_tokens(infile: str, counts: MutableMapping[str, int]):
+	for token in read_tokens(infile):
+		try:
+			counts[token] += 1
+		except KeyError:
+			counts[token] = 1
+
+
+def count_all_tokens(infiles: Iterable[str], doc_freqs: Optional[MutableMapping[str, int]] = None) -> Dict[str, int]:
+	"""
+	Counts all tokens in the given files in a single mapping without keeping the counts for each file.
+
+	:param infiles: The files to read.
+	:param doc_freqs: If not None, a mapping to add the number of files each token type occurs in to.
+	:return: The count of each token type summed over all files.
+	"""
+	result = {}
+	for infile in infiles:
+		print("Reading \"{}\".".format(infile), file=sys.stderr)
+		if doc_freqs is None:
+			count_tokens(infile, result)
+		else:
+			file_counts = {}
+			count_tokens(infile, file_counts)
+			for token, count in file_counts.items():
+				result[token] = result.get(token, 0) + count
+				doc_freqs[token] = doc_freqs.get(token, 0) + 1
+	return result
+
+
+def count_ngrams(infiles: Iterable[str], order: int, count_doc_freqs: bool = True) -> NGramCounter:
+	"""
+	Counts n-grams of every length up to the given order and optionally the document frequency of each token type, tokenizing each file only once.
+
+	:param infiles: The files to read.
+	:param order: The maximum n-gram length to count.
+	:param count_doc_freqs: If True, also count the number of files each token type occurs in.
+	:return: The counter containing the counts for all files.
+	"""
+	result = NGramCounter(order, count_doc_freqs=count_doc_freqs)
+	for infile in infiles:
+		print("Reading \"{}\".".format(infile), file=sys.stderr)
+		result.add_document(read_token_seqs(infile))
+	return result
+
+
+def count_tokens_approximately(infiles: Iterable[str], capacity: int,
+							   doc_freqs: Optional[MutableMapping[str, int]] = None) -> Dict[str, int]:
+	"""
+	Counts the most frequent token types in two passes, the first finding candidate types using a bounded amount of memory and the second counting the candidates exactly.
+
+	:param infiles: The files to read.
+	:param capacity: The number of candidate types to keep.
+	:param doc_freqs: If not None, a mapping to add the number of files each candidate type occurs in to.
+	:return: The exact count of each candidate type.
+	"""
+	counter = MisraGriesCounter(capacity)
+	for infile in infiles:
+		print("Finding candidate types in \"{}\".".format(infile), file=sys.stderr)
+		counter.update(read_tokens(infile))
+	print("Found {} candidate token type(s).".format(len(counter)), file=sys.stderr)
+
+	result = dict.fromkeys(counter.counts.keys(), 0)
+	for infile in infiles:
+		print("Counting candidate types in \"{}\".".format(infile), file=sys.stderr)
+		file_types = set()
+		for token in read_tokens(infile):
+			if token in result:
+				result[token] += 1
+				file_types.add(token)
+		if doc_freqs is not None:
+			for token in file_types:
+				doc_freqs[token] = doc_freqs.get(token, 0) + 1
+	return result
+
+
+def read_token_seqs(infile: str) -> Iterator[List[str]]:
 	with open(infile, 'r') as inf:
 		for line in inf:
-			tokens = nltk.tokenize.word_tokenize(line)
-			for token in tokens:
-				try:
-					counts[token] += 1
-				except KeyError:
-					counts[token] = 1
+			yield nltk.tokenize.word_tokenize(line)
 
 
-def __main(args):
-	infiles = args.infiles
-	counts = {}
+def read_tokens(infile: str) -> Iterator[str]:
+	for tokens in read_token_seqs(infile):
+		yield from tokens
+
+
+def __count_stored_tokens(args) -> Tuple[Dict[str, int], Optional[Dict[str, int]]]:
+	store_path = args.store
+	if store_path and os.path.exists(store_path):
+		print("Loading counts from \"{}\".".format(store_path), file=sys.stderr)
+		store = TokenCountStore.load(store_path)
+	else:
+		store = TokenCountStore()
+
+	if args.prune_missing:
+		stale_paths = tuple(path for path in store if not os.path.exists(path))
+		for path in stale_paths:
+			print("Removing counts for missing file \"{}\".".format(path), file=sys.stderr)
+			store.remove(path)
+	for merge_path in args.merge:
+		print("Merging counts from \"{}\".".format(merge_path), file=sys.stderr)
+		store.merge(TokenCountStore.load(merge_path))
+
+	# Use absolute paths so that the same store can be updated from any working directory
+	infiles = tuple(os.path.abspath(infile) for infile in args.infiles)
 	for infile in infiles:
-		print("Reading \"{}\".".format(infile), file=sys.stderr)
-		count_tokens(infile, counts)
+		if store.is_current(infile):
+			print("Using stored counts for \"{}\".".format(infile), file=sys.stderr)
+		else:
+			print("Reading \"{}\".".format(infile), file=sys.stderr)
+			# Get the fingerprint before reading so that changes made during reading are counted in the next run
+			fingerprint = create_file_fingerprint(infile)
+			file_counts = {}
+			count_tokens(infile, file_counts)
+			store.put(infile, file_counts, fingerprint)
+
+	if store_path:
+		print("Saving counts for {} file(s) to \"{}\".".format(len(store), store_path), file=sys.stderr)
+		store.save(store_path)
+
+	return store.total_counts(), store.document_frequencies() if args.doc_freq else None
+
+
+def __validate_args(args, argparser: argparse.ArgumentParser):
+	if args.ngram_order < 1:
+		argparser.error("N-gram order must be positive but was {}.".format(args.ngram_order))
+	if args.approximate is not None:
+		if args.approximate < 1:
+			argparser.error("Approximate-counting capacity must be positive but was {}.".format(args.approximate))
+		if args.merge:
+			argparser.error("Count stores cannot be merged when counting approximately.")
+	if args.ngram_order > 1:
+		if args.store or args.merge or args.approximate is not None:
+			argparser.error("N-grams cannot be counted together with a count store or approximate counting.")
+		if not args.ngram_outfile_prefix:
+			argparser.error("An n-gram outfile prefix is required for counting n-grams.")
+
+
+def __write_ngram_counts(counter: NGramCounter, outfile_prefix: str, min_count: int, top_k: Optional[int]):
+	for n in range(2, counter.order + 1):
+		outfile_path = "{}.{}grams.tsv".format(outfile_prefix, n)
+		ngram_counts = counter.pruned_counts(n, min_count, top_k)
+		print("Writing {} unique {}-gram(s) to \"{}\".".format(len(ngram_counts), n, outfile_path), file=sys.stderr)
+		with open(outfile_path, 'w', newline='') as outf:
+			writer = csv.writer(outf, dialect=csv.excel_tab)
+			writer.writerow(tuple("TOKEN_{}".format(idx) for idx in range(1, n + 1)) + ("COUNT",))
+			for ngram, count in ngram_counts:
+				writer.writerow(ngram + (count,))
+
+
+def __main(args):
+	ngram_order = args.ngram_order
+	if ngram_order > 1:
+		counter = count_ngrams(args.infiles, ngram_order, args.doc_freq)
+		counts = counter.token_counts()
+		doc_freqs = counter.document_frequencies() if args.doc_freq else None
+		__write_ngram_counts(counter, args.ngram_outfile_prefix, args.min_count, args.top_k)
+	elif args.approximate is not None:
+		if args.top_k is not None and args.top_k > args.approximate:
+			print("WARNING: Top-K value {} is greater than the approximate-counting capacity {}; Less-frequent types may be missing.".format(
+				args.top_k, args.approximate), file=sys.stderr)
+		doc_freqs = {} if args.doc_freq else None
+		counts = count_tokens_approximately(args.infiles, args.approximate, doc_freqs)
+	elif args.store or args.merge:
+		counts, doc_freqs = __count_stored_tokens(args)
+	else:
+		doc_freqs = {} if args.doc_freq else None
+		counts = count_all_tokens(args.infiles, doc_freqs)
 	print("Found {} unique token type(s).".format(len(counts)), file=sys.stderr)
 
 	writer = csv.writer(sys.stdout, dialect=csv.excel_tab)
-	writer.writerow(("TOKEN", "COUNT"))
-	for token, count in sorted(sorted(counts.items(), key=lambda item: item[0]), key=lambda item: item[1],
-							   reverse=True):
-		writer.writerow((token, count))
+	if args.doc_freq:
+		writer.writerow(("TOKEN", "COUNT", "DOC_FREQ"))
+		for token, count in prune_counts(counts, args.min_count, args.top_k):
+			writer.writerow((token, count, doc_freqs[token]))
+	else:
+		writer.writerow(("TOKEN", "COUNT"))
+		for token, count in prune_counts(counts, args.min_count, args.top_k):
+			writer.writerow((token, count))
 
 
 if __name__ == "__main__":
-	__main(__create_argparser().parse_args())
+	argparser = __create_argparser()
+	args = argparser.parse_args()
+	__validate_args(args, argparser)
+	__main(args)